@@ -0,0 +1,328 @@
+"""Load test for game_server_http.py with many simulated headless players.
+
+Every player keeps one connection open and follows the client's command pattern:
+register_player, then per frame set_player_state + get_game_state, with a
+collect_gem / check_hazard_collision / player_at_exit now and then. Players are
+paired into rooms (one black, one white each). The result is printed as JSON:
+throughput, latency percentiles and error rates per command, and the CPU time and
+memory of the server process(es).
+
+Usage:
+    python bench_load.py --players 20 --rate 60 --duration 10 --server-args "--mode eventloop"
+    python bench_load.py --port 8889 --server-pid 1234     # measure an already running server
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import wire_format
+
+# One of these per player, every EVENT_INTERVAL frames, in turn.
+EVENT_COMMANDS = ("collect_gem", "check_hazard_collision", "player_at_exit")
+EVENT_INTERVAL = 30
+# Players sway 100px around their spawn point, kept between the side walls (and inside the
+# range set_player_state accepts) so every report takes the normal path.
+SWAY = 100
+MIN_X, MAX_X = 20, 800 - 20 - 48
+MAX_REDIRECTS = 3
+SERVER_START_TIMEOUT = 10.0
+
+
+class Connection:
+    """Minimal keep-alive HTTP client speaking the same requests as ClientInterface."""
+
+    def __init__(self, address, binary=False):
+        self.address = address
+        self.accept = f"{wire_format.CONTENT_TYPE}, {wire_format.JSON_CONTENT_TYPE}" if binary else wire_format.JSON_CONTENT_TYPE
+        self.sock = None
+        self.buffer = b""
+
+    def command(self, room, command_str):
+        path = f"/game/{room}/" + command_str.replace(" ", "/")
+        for _ in range(MAX_REDIRECTS + 1):
+            if self.sock is None:
+                self.sock = socket.create_connection(self.address)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.buffer = b""
+            self.sock.sendall(f"GET {path} HTTP/1.1\r\nHost: {self.address[0]}:{self.address[1]}\r\n"
+                              f"Accept: {self.accept}\r\nConnection: keep-alive\r\n\r\n".encode())
+            while b"\r\n\r\n" not in self.buffer:
+                self._recv()
+            header_end = self.buffer.find(b"\r\n\r\n")
+            lines = self.buffer[:header_end].decode().split("\r\n")
+            status = int(lines[0].split(" ")[1])
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body_end = header_end + 4 + int(headers.get("content-length", 0))
+            while len(self.buffer) < body_end:
+                self._recv()
+            body, self.buffer = self.buffer[header_end + 4:body_end], self.buffer[body_end:]
+            # A sharded server points us at the worker that owns the room; stay with it.
+            if status != 307:
+                break
+            location = urlsplit(headers["location"])
+            self.close()
+            self.address = (location.hostname, location.port)
+        if headers.get("content-type") == wire_format.CONTENT_TYPE:
+            return wire_format.decode(body)
+        return json.loads(body)
+
+    def _recv(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("Server closed the connection")
+        self.buffer += chunk
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+        self.sock = None
+
+
+class CommandStats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.rejected = {}
+
+    def record(self, command, latency, result):
+        self.latencies.setdefault(command, []).append(latency)
+        if result is None:
+            self.errors[command] = self.errors.get(command, 0) + 1
+        elif result.get("status") != "OK":
+            self.rejected[command] = self.rejected.get(command, 0) + 1
+
+    def merge(self, other):
+        for command, latencies in other.latencies.items():
+            self.latencies.setdefault(command, []).extend(latencies)
+        for mine, theirs in ((self.errors, other.errors), (self.rejected, other.rejected)):
+            for command, count in theirs.items():
+                mine[command] = mine.get(command, 0) + count
+
+
+def run_player(address, room, color, rate, duration, binary, stats):
+    connection = Connection(address, binary)
+
+    def timed(command_str):
+        start = time.perf_counter()
+        try:
+            result = connection.command(room, command_str)
+        except (OSError, ValueError):
+            connection.close()
+            result = None
+        stats.record(command_str.split(" ", 1)[0], time.perf_counter() - start, result)
+        return result
+
+    registered = timed(f"register_player {color}")
+    if not registered or registered.get("status") != "OK":
+        return
+    player_id = registered["player_id"]
+    base_x, y = registered["x"], registered["y"]
+
+    interval = 1.0 / rate
+    start = next_frame = time.monotonic()
+    frame, state = 0, None
+    while time.monotonic() - start < duration:
+        x = min(max(int(base_x + SWAY * math.sin(frame / 20)), MIN_X), MAX_X)
+        timed(f"set_player_state {player_id} {x} {y}")
+        state = timed("get_game_state") or state
+
+        if frame % EVENT_INTERVAL == EVENT_INTERVAL - 1 and state and state.get("status") == "OK":
+            event = EVENT_COMMANDS[(frame // EVENT_INTERVAL) % len(EVENT_COMMANDS)]
+            if event == "collect_gem":
+                gem_id = next((g["id"] for g in state["gems"] if g["type"] == color), None)
+                if gem_id: timed(f"collect_gem {player_id} {gem_id}")
+            elif event == "check_hazard_collision":
+                if state["hazards"]: timed(f"check_hazard_collision {player_id} {state['hazards'][0]['id']}")
+            else:
+                timed(f"player_at_exit {player_id}")
+
+        frame += 1
+        next_frame += interval
+        delay = next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_frame = time.monotonic()
+    connection.close()
+
+
+def run_players(address, players, rate, duration, binary, results=None):
+    """Runs (room, color) players on threads; returns (or puts on results) their merged stats."""
+    thread_stats = [CommandStats() for _ in players]
+    threads = [threading.Thread(target=run_player, args=(address, room, color, rate, duration, binary, stats))
+               for (room, color), stats in zip(players, thread_stats)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    total = CommandStats()
+    for stats in thread_stats: total.merge(stats)
+    if results is not None:
+        results.put(total)
+    return total
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+
+def _process_tree(pid):
+    """pid and all its descendants (sharded servers run one process per worker)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        current = todo.pop()
+        tree.append(current)
+        todo.extend(children.get(current, []))
+    return tree
+
+
+def server_usage(pid):
+    """(CPU seconds, resident bytes) summed over the server's processes; None off Linux."""
+    if pid is None or not os.path.isdir("/proc"):
+        return None
+    ticks, rss_pages = 0, 0
+    for member in _process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])
+            with open(f"/proc/{member}/statm") as f:
+                rss_pages += int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return ticks / os.sysconf("SC_CLK_TCK"), rss_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def wait_for_server(address, timeout=SERVER_START_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(address, timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test game_server_http.py with simulated players")
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=60, help="frames per second per player")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of load")
+    parser.add_argument('--processes', type=int, default=1, help="load generator processes sharing the players")
+    parser.add_argument('--binary', action='store_true', help="ask for the binary state format instead of JSON")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--server-args', default='',
+                        help="start game_server_http.py on --port with these extra arguments (default)")
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help="use the server already running on --port, measuring this process")
+    parser.add_argument('--output', help="write the JSON result here instead of stdout")
+    args = parser.parse_args()
+    address = (args.host, args.port)
+
+    server, server_pid = None, args.server_pid
+    if server_pid is None:
+        command = [sys.executable, "game_server_http.py", "--port", str(args.port),
+                   "--log-sample", "request=0", "--log-sample", "connection=0", *shlex.split(args.server_args)]
+        server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        server_pid = server.pid
+    try:
+        if not wait_for_server(address):
+            sys.exit(f"No server listening on {args.host}:{args.port}")
+
+        rooms = [f"bench{i}" for i in range((args.players + 1) // 2)]
+        setup = Connection(address)
+        for room in rooms:
+            setup.command(room, "reset_game")
+        setup.close()
+        players = [(rooms[i // 2], "black" if i % 2 == 0 else "white") for i in range(args.players)]
+
+        usage_before = server_usage(server_pid)
+        started = time.monotonic()
+        if args.processes > 1:
+            results = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=run_players, args=(address, players[i::args.processes], args.rate,
+                                                                         args.duration, args.binary, results))
+                       for i in range(args.processes)]
+            for worker in workers: worker.start()
+            stats = CommandStats()
+            for _ in workers: stats.merge(results.get())
+            for worker in workers: worker.join()
+        else:
+            stats = run_players(address, players, args.rate, args.duration, args.binary)
+        elapsed = time.monotonic() - started
+        usage_after = server_usage(server_pid)
+    finally:
+        if server is not None:
+            # The whole group, so the workers of a sharded server go too.
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait()
+
+    commands = {}
+    for command, latencies in sorted(stats.latencies.items()):
+        latencies.sort()
+        count = len(latencies)
+        commands[command] = {
+            "count": count,
+            "throughput_rps": round(count / elapsed, 1),
+            "errors": stats.errors.get(command, 0),
+            "error_rate": round(stats.errors.get(command, 0) / count, 4),
+            "rejected": stats.rejected.get(command, 0),
+            "mean_ms": round(sum(latencies) / count * 1000, 3),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        }
+    total_requests = sum(c["count"] for c in commands.values())
+    report = {
+        "config": {"players": args.players, "rate": args.rate, "duration": args.duration, "processes": args.processes,
+                   "binary": args.binary, "server_args": args.server_args if server is not None else None},
+        "elapsed_s": round(elapsed, 3),
+        "requests": total_requests,
+        "throughput_rps": round(total_requests / elapsed, 1),
+        "error_rate": round(sum(stats.errors.values()) / total_requests, 4) if total_requests else None,
+        "commands": commands,
+        "server": None,
+    }
+    if usage_before and usage_after:
+        cpu_seconds = usage_after[0] - usage_before[0]
+        report["server"] = {"cpu_seconds": round(cpu_seconds, 3), "cpu_percent": round(cpu_seconds / elapsed * 100, 1),
+                            "rss_bytes": usage_after[1]}
+
+    if stats.rejected.get("set_player_state"):
+        print(f"warning: {stats.rejected['set_player_state']} set_player_state reports were rejected", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare JSON and the binary wire format on PlayerServerProtocol state responses,
+and encoding every read against PlayerServerProtocol.proses_encoded's response cache.
+
+Usage: python bench_wire_format.py [iterations]
+"""
+import json
+import logging
+import sys
+import timeit
+
+import wire_format
+from protocol import PlayerServerProtocol
+
+
+def _prepare_protocol():
+    logging.disable(logging.CRITICAL)
+    protocol = PlayerServerProtocol()
+    protocol.proses("register_player black")
+    protocol.proses("register_player white")
+    protocol._load_level(2)
+    protocol.proses("set_player_state player_black 60 532")
+    logging.disable(logging.NOTSET)
+    return protocol
+
+
+def bench(name, result, iterations):
+    json_bytes = json.dumps(result).encode()
+    binary_bytes = wire_format.encode(result)
+    assert wire_format.decode(binary_bytes) == json.loads(json_bytes)
+
+    rows = {
+        'json': (len(json_bytes),
+                 timeit.timeit(lambda: json.dumps(result).encode(), number=iterations),
+                 timeit.timeit(lambda: json.loads(json_bytes), number=iterations)),
+        'binary': (len(binary_bytes),
+                   timeit.timeit(lambda: wire_format.encode(result), number=iterations),
+                   timeit.timeit(lambda: wire_format.decode(binary_bytes), number=iterations)),
+    }
+    print(f"{name}:")
+    for fmt, (size, encode_time, decode_time) in rows.items():
+        print(f"  {fmt:<7} {size:>6} bytes  encode {encode_time / iterations * 1e6:8.2f} us"
+              f"  decode {decode_time / iterations * 1e6:8.2f} us")
+
+
+def bench_response_cache(command, protocol, iterations):
+    cached, fresh = (json.loads(body) for _, body in (protocol.proses_encoded(command),
+                                                      wire_format.encode_response(protocol.proses(command), False)))
+    for result in (cached, fresh):
+        result.get('game_info', {}).pop('elapsed_time', None)
+    assert cached == fresh
+    uncached = timeit.timeit(lambda: wire_format.encode_response(protocol.proses(command), False), number=iterations)
+    cached = timeit.timeit(lambda: protocol.proses_encoded(command), number=iterations)
+    print(f"{command} per request:")
+    print(f"  encode every time {uncached / iterations * 1e6:8.2f} us")
+    print(f"  response cache    {cached / iterations * 1e6:8.2f} us")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    protocol = _prepare_protocol()
+    bench("get_game_state", protocol.snapshot.game_state(), iterations)
+    bench("get_dynamic_state", protocol.snapshot.dynamic_state(), iterations)
+    bench("get_state_since (one player moved)", protocol.snapshot.state_since(protocol.state_version - 1), iterations)
+    bench_response_cache("get_level", protocol, iterations)
+    bench_response_cache("get_game_state", protocol, iterations)
+
+
+if __name__ == "__main__":
+    main()
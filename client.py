@@ -1,11 +1,21 @@
 import sys
+import os
+import argparse
 import io
+import threading
+import queue
 import socket
 import logging
 import json
 import base64
+import struct
 import pygame
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+import wire_format
 
 WIDTH, HEIGHT = 800, 600
 FPS = 60
@@ -15,98 +25,524 @@ GEM_SIZE = (20, 20)
 HAZARD_DEFAULT_SIZE = (100, 50)
 EXIT_SIZE = (80, 80)
 WALL_UNIT_SIZE = 20
+GRID_CELL_SIZE = 64
+TEXTURE_CACHE_SIZE = 64
 GRAVITY = 0.5
 JUMP_STRENGTH = -10
 TERMINAL_VELOCITY = 10
+MAX_REDIRECTS = 3
+# Must not exceed protocol.MAX_BATCH_COMMANDS; longer queues go out as several batches.
+MAX_BATCH_COMMANDS = 32
+NETWORK_POLL_INTERVAL = 1 / FPS
+# Remote players are drawn this far behind the newest snapshot (and at least two polls),
+# and carried on along their last motion for at most MAX_EXTRAPOLATION when one is late.
+INTERPOLATION_DELAY = 0.1
+MAX_EXTRAPOLATION = 0.1
+SNAPSHOT_BUFFER_SIZE = 32
+# Jumps longer than this between snapshots (respawns) are not smoothed.
+MAX_INTERPOLATION_DISTANCE = 100
+# Recently reported local positions, recognised when the server echoes them back.
+SENT_POSITION_HISTORY = 64
+# Button bits sent with player_input when the server runs the simulation (see protocol.py).
+INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP = 1, 2, 4
 WHITE, BLACK, RED, GREY, WIN_GREEN, GREEN = (255, 255, 255), (0, 0, 0), (255, 0, 0), (150, 150, 150), (0, 200, 0), (0, 200, 0)
 
-# ---Initialization ---
-pygame.init()
-pygame.mixer.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Game of Bones")
-clock = pygame.time.Clock()
-
-# --- Fonts ---
 FONT_PATH = 'assets/fonts/PixelGameFont.ttf'
-font_large = pygame.font.Font(FONT_PATH, 74)
-font_medium = pygame.font.Font(FONT_PATH, 36)
-font_small = pygame.font.Font(FONT_PATH, 24)
-font_ingame = pygame.font.Font(FONT_PATH, 20)
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# --- Initialization (see setup) ---
+screen, clock = None, None
+font_large = font_medium = font_small = font_ingame = None
+# Set by setup(headless=True): no window, audio or asset files, only the game logic.
+headless = False
+
+
+def setup(headless_mode=False):
+    """Initializes pygame, the window, the mixer and the fonts; importing this module does
+    none of that. In headless mode SDL gets its dummy video and audio drivers and no
+    window, sounds, sprites or fonts are loaded, so ClientInterface, PlayerCharacter and
+    main_game_loop can run in bots and tests, many clients to a process."""
+    global screen, clock, font_large, font_medium, font_small, font_ingame, headless
+    if clock is not None:
+        return
+    headless = headless_mode
+    if headless:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    logging.basicConfig(level=logging.WARNING if headless else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    pygame.init()
+    clock = pygame.time.Clock()
+    if headless:
+        return
+
+    pygame.mixer.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Game of Bones")
+    font_large = pygame.font.Font(FONT_PATH, 74)
+    font_medium = pygame.font.Font(FONT_PATH, 36)
+    font_small = pygame.font.Font(FONT_PATH, 24)
+    font_ingame = pygame.font.Font(FONT_PATH, 20)
+
 
 class ClientInterface:
     """Handles communication with the game server."""
 
-    def __init__(self):
+    def __init__(self, room=None):
         # self.server_address = ('127.0.0.1', 58123)
         # self.server_address = ('192.168.46.183', 58123)
         self.server_address = ('127.0.0.1', 8889)
         # self.server_address = ('57.155.89.38', 8889)
+        self.sock = None
+        self.recv_buffer = b""
+        # Ask for the compact binary state format; servers that don't know it answer in JSON.
+        self.use_binary = True
+        self.pending_commands = []
+        # Named match on the server; None plays in the server's default room.
+        self.room = room
 
 
-    def send_command(self, command_str=""):
+    def _connect(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            sock.connect(self.server_address)
-            
-            url_path = "/game/" + command_str.replace(" ", "/")
-            
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.connect(self.server_address)
+        self.sock = sock
+        self.recv_buffer = b""
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.recv_buffer = b""
+
+    def _read_response(self):
+        while b'\r\n\r\n' not in self.recv_buffer:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            self.recv_buffer += chunk
+
+        header_end = self.recv_buffer.find(b'\r\n\r\n')
+        header_lines = self.recv_buffer[:header_end].decode('utf-8').split('\r\n')
+        status = int(header_lines[0].split(' ')[1])
+        headers = {}
+        for line in header_lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        content_length = int(headers.get('content-length', 0))
+        body_end = header_end + 4 + content_length
+        while len(self.recv_buffer) < body_end:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            self.recv_buffer += chunk
+
+        body = self.recv_buffer[header_end + 4:body_end]
+        self.recv_buffer = self.recv_buffer[body_end:]
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers, body
+
+    def send_command(self, command_str=""):
+        url_path = "/game/" + (f"{self.room}/" if self.room else "") + command_str.replace(" ", "/")
+        accept = f"{wire_format.CONTENT_TYPE}, {wire_format.JSON_CONTENT_TYPE}" if self.use_binary else wire_format.JSON_CONTENT_TYPE
+
+        retried, redirects = False, 0
+        while True:
             request = (
-                f"GET {url_path} HTTP/1.0\r\n"
+                f"GET {url_path} HTTP/1.1\r\n"
                 f"Host: {self.server_address[0]}:{self.server_address[1]}\r\n"
-                f"Connection: close\r\n"
+                f"Accept: {accept}\r\n"
+                f"Connection: keep-alive\r\n"
                 "\r\n"
             )
-            
-            sock.sendall(request.encode('utf-8'))
-            
-            data_received = b""
-            while True:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                data_received += chunk
-
-            if not data_received:
-                return {"status": "ERROR", "message": "Empty response from server"}
-
-            header_end = data_received.find(b'\r\n\r\n')
-            if header_end == -1:
-                return {"status": "ERROR", "message": "Invalid HTTP response"}
+            reused = self.sock is not None
+            try:
+                if not reused:
+                    self._connect()
+                self.sock.sendall(request.encode('utf-8'))
+                status, headers, body = self._read_response()
+            except Exception as e:
+                self.close()
+                # A reused socket may have been dropped by the server while idle, so a
+                # failure on it is retried once over a fresh connection.
+                if reused and not retried:
+                    retried = True
+                    continue
+                return {"status": "ERROR", "message": f"Connection error: {e}"}
+
+            # A sharded server points us at the worker that owns our room; stay with it.
+            if status == 307 and 'location' in headers and redirects < MAX_REDIRECTS:
+                location = urlsplit(headers['location'])
+                self.server_address = (location.hostname, location.port)
+                self.close()
+                redirects += 1
+                continue
+            break
+
+        content_type = headers.get('content-type', '')
+
+        if content_type == wire_format.CONTENT_TYPE:
+            try:
+                return wire_format.decode(body)
+            except (ValueError, IndexError, struct.error):
+                self.use_binary = False
+                return {"status": "ERROR", "message": "Failed to decode binary state from server"}
 
-            json_body = data_received[header_end + 4:]
-            
-            decoded_data = json_body.decode('utf-8').strip()
+        try:
+            decoded_data = body.decode('utf-8').strip()
             if decoded_data:
                 return json.loads(decoded_data)
-            
+
             return {"status": "ERROR", "message": "Empty JSON body in response"}
-            
+
         except json.JSONDecodeError:
             return {"status": "ERROR", "message": "Failed to decode JSON from server"}
-        except Exception as e:
-            return {"status": "ERROR", "message": f"Connection error: {e}"}
-        finally:
-            sock.close()
+
+    def queue_command(self, command_str):
+        """Defers a command until the next flush_commands call."""
+        self.pending_commands.append(command_str)
+
+    def flush_commands(self, *command_strs):
+        """Sends every queued command plus command_strs as one batch request.
+
+        Returns one result per command, in order."""
+        commands = self.pending_commands + list(command_strs)
+        self.pending_commands = []
+        if not commands:
+            return []
+        if len(commands) == 1:
+            # A lone read goes out as itself, so the server can answer it from its response cache.
+            return [self.send_command(commands[0])]
+        response = self.send_command("batch " + ";".join(commands))
+        if response.get('status') != 'OK' or 'results' not in response:
+            return [response] * len(commands)
+        return response['results']
 
     def register_player(self, color): return self.send_command(f"register_player {color}")
-    def set_player_state(self, player_id, x, y, lives): return self.send_command(f"set_player_state {player_id} {x} {y} {lives}")
+    def set_player_state(self, player_id, x, y): return self.send_command(f"set_player_state {player_id} {x} {y}")
     def get_game_state(self): return self.send_command("get_game_state")
+    def get_level(self): return self.send_command("get_level")
+    def get_dynamic_state(self): return self.send_command("get_dynamic_state")
+    def get_state_since(self, state_version): return self.send_command(f"get_state_since {state_version}")
     def collect_gem(self, player_id, gem_id): return self.send_command(f"collect_gem {player_id} {gem_id}")
     def check_hazard_collision(self, player_id, hazard_id): return self.send_command(f"check_hazard_collision {player_id} {hazard_id}")
     def player_at_exit(self, player_id): return self.send_command(f"player_at_exit {player_id}")
+    def player_input(self, player_id, buttons): return self.send_command(f"player_input {player_id} {buttons}")
+    def get_server_info(self): return self.send_command("get_server_info")
     def reset_game(self): return self.send_command(f"reset_game")
 
 
+class NetworkWorker:
+    """Owns a ClientInterface on a background thread so drawing never waits on the server.
+
+    Commands are queued and go out together with the next state poll, every poll_interval
+    seconds however often they are queued. Every queued set_player_state is sent, so the
+    server checks pickups, hazards and the exit against each position. Each poll's diff is
+    merged into a complete snapshot (with the stage layout under 'level'), and the render
+    loop reads the newest one from `snapshot`; `error` holds the last failure, if any."""
+
+    def __init__(self, client_interface, poll_interval=NETWORK_POLL_INTERVAL):
+        self.client_interface = client_interface
+        self.poll_interval = poll_interval
+        self.outbound = queue.Queue()
+        self.snapshot = None
+        self.error = None
+        self._level, self._players, self._gems = None, {}, {}
+        self._state_version = 0
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Lets the thread finish its current request and close the connection."""
+        self._stopped.set()
+
+    def submit(self, command_str):
+        """Queues a command; the returned Future resolves to its result."""
+        future = Future()
+        self.outbound.put((command_str, future))
+        return future
+
+    def queue_command(self, command_str):
+        """Fire-and-forget counterpart of submit, same signature as ClientInterface's."""
+        self.outbound.put((command_str, None))
+
+    def _run(self):
+        next_poll = time.monotonic()
+        # Queued commands wait for the next poll, so the request rate is the poll rate.
+        while not self._stopped.wait(max(0, next_poll - time.monotonic())):
+            next_poll = time.monotonic() + self.poll_interval
+            commands = self._drain()
+            try:
+                self._poll(commands)
+            except Exception as e:
+                logging.error(f"Network worker: poll failed: {e}")
+                self.error = str(e)
+                self._resolve(commands, [{"status": "ERROR", "message": self.error}] * len(commands))
+        commands = self._drain()
+        self._resolve(commands, [{"status": "ERROR", "message": "Network worker stopped"}] * len(commands))
+        self.client_interface.close()
+
+    def _drain(self):
+        commands = []
+        while True:
+            try:
+                commands.append(self.outbound.get_nowait())
+            except queue.Empty:
+                return commands
+
+    def _poll(self, commands):
+        while len(commands) >= MAX_BATCH_COMMANDS:
+            chunk, commands = commands[:MAX_BATCH_COMMANDS], commands[MAX_BATCH_COMMANDS:]
+            self._resolve(chunk, self.client_interface.flush_commands(*[c for c, _ in chunk]))
+        results = self.client_interface.flush_commands(*[c for c, _ in commands], f"get_state_since {self._state_version}")
+        self._resolve(commands, results)
+        self._merge(results[-1])
+
+    def _resolve(self, commands, results):
+        for (_, future), result in zip(commands, results):
+            if future and not future.done(): future.set_result(result)
+
+    def _merge(self, state):
+        if not (state and state.get('status') == 'OK'):
+            self.error = state.get('message', 'Server error') if state else 'No response from server'
+            return
+
+        if self._level is None or state['level_version'] != self._level['level_version']:
+            level = self.client_interface.get_level()
+            if not (level and level.get('status') == 'OK'):
+                self.error = level.get('message', 'Failed to load level')
+                return
+            self._level = level
+            if not state['full'] or level['level_version'] != state['level_version']:
+                # This diff belongs to another stage; resync from a full snapshot next poll.
+                self._state_version = 0
+                return
+
+        # Full snapshots replace what we hold; diffs only carry what changed since _state_version.
+        self._state_version = state['state_version']
+        if state['full']:
+            self._players.clear(); self._gems.clear()
+        else:
+            for g_id in state['removed_gems']: self._gems.pop(g_id, None)
+        self._players.update(state['players'])
+        for g in state['gems']: self._gems[g['id']] = g
+
+        self.error = None
+        # A fresh dict per poll, so the render loop can hold one without locking.
+        self.snapshot = {
+            "status": "OK",
+            "level": self._level,
+            "level_version": self._level['level_version'],
+            "state_version": self._state_version,
+            "tick": state['tick'],
+            "server_time": state['server_time'],
+            "received_at": time.monotonic(),
+            "players": dict(self._players),
+            "gems": dict(self._gems),
+            "game_info": state['game_info']
+        }
+
+
+class SnapshotBuffer:
+    """Ring buffer of recent player snapshots on the server's clock.
+
+    Remote players are drawn `delay` seconds in the past, interpolated between the two
+    snapshots around that moment, so their motion no longer depends on when polls land."""
+
+    def __init__(self, delay=INTERPOLATION_DELAY, size=SNAPSHOT_BUFFER_SIZE):
+        self.delay = delay
+        self.snapshots = deque(maxlen=size)
+
+    def push(self, server_time, received_at, players):
+        if self.snapshots and server_time <= self.snapshots[-1][0]:
+            if server_time == self.snapshots[-1][0]:
+                return
+            # The server clock went backwards: it restarted, so the old timeline is useless.
+            self.snapshots.clear()
+        self.snapshots.append((server_time, received_at, players))
+
+    def clear(self):
+        self.snapshots.clear()
+
+    def positions(self, now):
+        """Returns {player_id: (x, y)} for local monotonic time `now`."""
+        if not self.snapshots:
+            return {}
+        # The snapshot that arrived fastest pins the server clock to ours.
+        offset = max(server_time - received_at for server_time, received_at, _ in self.snapshots)
+        render_time = now + offset - self.delay
+
+        result = {}
+        for p_id in self.snapshots[-1][2]:
+            previous = before = after = None
+            for server_time, _, players in self.snapshots:
+                p_data = players.get(p_id)
+                if p_data is None: continue
+                if server_time <= render_time: previous, before = before, (server_time, p_data)
+                else: after = (server_time, p_data); break
+
+            if before is None:
+                start = end = after
+                alpha = 0
+            elif after is not None:
+                start, end = before, after
+                alpha = (render_time - before[0]) / (after[0] - before[0])
+            elif previous is not None:
+                # The next snapshot is late: keep going along the last known motion, briefly.
+                start, end = previous, before
+                alpha = 1 + min(render_time - before[0], MAX_EXTRAPOLATION) / (before[0] - previous[0])
+            else:
+                start = end = before
+                alpha = 0
+
+            (_, p0), (_, p1) = start, end
+            if p1.get('is_dead') or abs(p1['x'] - p0['x']) + abs(p1['y'] - p0['y']) > MAX_INTERPOLATION_DISTANCE:
+                result[p_id] = (p1['x'], p1['y'])
+            else:
+                result[p_id] = (p0['x'] + (p1['x'] - p0['x']) * alpha, p0['y'] + (p1['y'] - p0['y']) * alpha)
+        return result
+
+
+class TextureCache:
+    """Decoded, scaled and display-converted surfaces for the server's base64 images.
+
+    Every wall, gem and hazard of a stage shares one surface per (image, size); the least
+    recently used entries are evicted once more than max_entries are held."""
+
+    def __init__(self, max_entries=TEXTURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._surfaces = OrderedDict()
+
+    def get(self, image_b64, size):
+        key = (image_b64, tuple(size))
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            return surface
+        surface = pygame.transform.scale(pygame.image.load(io.BytesIO(base64.b64decode(image_b64))), size)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self.max_entries:
+            self._surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+
+    def __len__(self):
+        return len(self._surfaces)
+
+
+texture_cache = TextureCache()
+
+
+class AssetManager:
+    """Loads each file under assets/ once and shares the results across players and screens.
+
+    preload() reads every image and sound on a background thread (the start screen uses
+    it); anything not preloaded yet is loaded on first use. Scaling and display conversion
+    happen on the calling thread and are cached per (path, size) as well. Failures raise
+    like pygame.image.load / pygame.mixer.Sound, so callers keep their own fallbacks."""
+
+    SOUND_EXTENSIONS = ('.wav', '.mp3', '.ogg')
+    # Streamed with pygame.mixer.music rather than decoded into a Sound.
+    STREAMED = ('assets/sound/main_music.mp3',)
+
+    def __init__(self, root='assets'):
+        self.root = root
+        self._lock = threading.Lock()
+        self._paths, self._raw_images, self._images, self._sheets, self._sounds = {}, {}, {}, {}, {}
+        self._preload_thread = None
+
+    def path(self, relative):
+        """Resolves a path case-insensitively, since the files on disk mix .mp3 and .MP3."""
+        resolved = self._paths.get(relative)
+        if resolved is None:
+            resolved = relative
+            if not os.path.exists(relative):
+                directory, name = os.path.split(relative)
+                try:
+                    resolved = next((os.path.join(directory, entry) for entry in os.listdir(directory or '.')
+                                     if entry.lower() == name.lower()), relative)
+                except OSError:
+                    pass
+            self._paths[relative] = resolved
+        return resolved
+
+    def _raw_image(self, path):
+        with self._lock:
+            raw = self._raw_images.get(path)
+            if raw is None:
+                raw = self._raw_images[path] = pygame.image.load(self.path(path))
+        return raw
+
+    def image(self, path, size=None, alpha=False, scale=None, smooth=False):
+        key = (path, size, alpha, scale, smooth)
+        surface = self._images.get(key)
+        if surface is None:
+            surface = self._raw_image(path)
+            surface = surface.convert_alpha() if alpha else surface.convert()
+            if scale is not None:
+                size = (int(surface.get_width() * scale), int(surface.get_height() * scale))
+            if size is not None:
+                surface = (pygame.transform.smoothscale if smooth else pygame.transform.scale)(surface, size)
+            self._images[key] = surface
+        return surface
+
+    def sprite_sheet(self, path, frame_count, size=CHARACTER_SIZE):
+        key = (path, frame_count, size)
+        frames = self._sheets.get(key)
+        if frames is None:
+            spritesheet = self.image(path, alpha=True)
+            w, h = spritesheet.get_width() // frame_count, spritesheet.get_height()
+            frames = self._sheets[key] = [pygame.transform.scale(spritesheet.subsurface(pygame.Rect(i * w, 0, w, h)), size)
+                                          for i in range(frame_count)]
+        return frames
+
+    def sound(self, path):
+        with self._lock:
+            sound = self._sounds.get(path)
+            if sound is None:
+                sound = self._sounds[path] = pygame.mixer.Sound(self.path(path))
+        return sound
+
+    def preload(self):
+        if self._preload_thread is None:
+            self._preload_thread = threading.Thread(target=self._preload_all, daemon=True)
+            self._preload_thread.start()
+
+    def _preload_all(self):
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name).replace(os.sep, '/')
+                extension = os.path.splitext(name)[1].lower()
+                try:
+                    if extension == '.png':
+                        self._raw_image(path)
+                    elif extension in self.SOUND_EXTENSIONS and path.lower() not in self.STREAMED:
+                        self.sound(path)
+                except Exception as e:
+                    logging.error(f"AssetManager: failed to preload {path} - {e}")
+
+
+assets = AssetManager()
+
+
 class GameObject:
     def __init__(self, id, x, y, size, image_b64, default_color=GREY):
         self.id = id
         self.rect = pygame.Rect(x, y, size[0], size[1])
-        if image_b64:
+        if image_b64 and not headless:
             try:
-                self.image = pygame.transform.scale(pygame.image.load(io.BytesIO(base64.b64decode(image_b64))), size)
+                self.image = texture_cache.get(image_b64, size)
             except Exception:
                 self._set_default_image(size, default_color)
         else:
@@ -119,8 +555,53 @@ class GameObject:
     def draw(self, surface):
         surface.blit(self.image, self.rect)
 
+class SpatialGrid:
+    """Uniform grid over GameObject rects, so collision checks only visit nearby objects.
+
+    query returns candidates in insertion order, matching a plain scan over the objects."""
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self._order, self._next_order = {}, 0
+
+    def _cells_for(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, max(rect.left, rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, max(rect.top, rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def insert(self, obj):
+        self._order[obj] = self._next_order
+        self._next_order += 1
+        for cell in self._cells_for(obj.rect):
+            self.cells.setdefault(cell, []).append(obj)
+
+    def remove(self, obj):
+        if self._order.pop(obj, None) is None:
+            return
+        for cell in self._cells_for(obj.rect):
+            bucket = self.cells.get(cell)
+            if bucket and obj in bucket:
+                bucket.remove(obj)
+                if not bucket: del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self._order.clear()
+
+    def query(self, rect):
+        found = set()
+        for cell in self._cells_for(rect):
+            found.update(self.cells.get(cell, ()))
+        return sorted(found, key=self._order.__getitem__)
+
+    def __len__(self):
+        return len(self._order)
+
+
 class PlayerCharacter:
-    def __init__(self, id, is_local_player=False, initial_color_choice=None):
+    def __init__(self, id, is_local_player=False, initial_color_choice=None, client_interface=None):
         self.id, self.is_local_player = id, is_local_player
         self.color_type = initial_color_choice
         self.x, self.y, self.speed = 0, 0, 5
@@ -130,6 +611,7 @@ class PlayerCharacter:
         
         self.target_x, self.target_y = 0, 0
         self.lerp_speed = 0.2
+        self.sent_positions = deque(maxlen=SENT_POSITION_HISTORY)
 
         self.animations, self.animation_speed = {}, 0.1
         self.last_update_time, self.current_frame_index = pygame.time.get_ticks(), 0
@@ -154,25 +636,25 @@ class PlayerCharacter:
         self.image = self.animations[self.current_animation][self.current_frame_index]
         self.rect = self.image.get_rect(topleft=(self.x, self.y))
         
-        if self.is_local_player: self.client_interface = ClientInterface()
+        if self.is_local_player: self.client_interface = client_interface or ClientInterface()
         logging.info(f"PlayerCharacter: Initialized {self.id} (Local: {self.is_local_player}, Color: {self.color_type})")
 
+        self.death_sound = self.get_gem_sound = self.Stagewin = self.winmatch = None
+        if headless:
+            return
         try:
-            self.death_sound = pygame.mixer.Sound('assets/sound/dead_sound.wav')
-            self.get_gem_sound = pygame.mixer.Sound('assets/sound/get_gem.wav')
-            self.Stagewin = pygame.mixer.Sound('assets/sound/Stagewin.mp3')
-            self.winmatch = pygame.mixer.Sound('assets/sound/WINMATCH.mp3')
+            self.death_sound = assets.sound('assets/sound/dead_sound.wav')
+            self.get_gem_sound = assets.sound('assets/sound/get_gem.wav')
+            self.Stagewin = assets.sound('assets/sound/Stagewin.mp3')
+            self.winmatch = assets.sound('assets/sound/WINMATCH.mp3')
         except pygame.error as e:
             print(f"Peringatan: Tidak bisa memuat file suara. Error: {e}")
-            self.death_sound = None
-            self.get_gem_sound = None
-            self.Stagewin = None
 
     def _load_sprite_sheet(self, filepath, frame_count):
+        if headless:
+            return [pygame.Surface(CHARACTER_SIZE)]
         try:
-            spritesheet = pygame.image.load(filepath).convert_alpha()
-            w, h = spritesheet.get_width() // frame_count, spritesheet.get_height()
-            return [pygame.transform.scale(spritesheet.subsurface(pygame.Rect(i * w, 0, w, h)), CHARACTER_SIZE) for i in range(frame_count)]
+            return assets.sprite_sheet(filepath, frame_count)
         except Exception as e:
             logging.error(f"Failed to load sprite: {filepath} - {e}")
             fallback = pygame.Surface(CHARACTER_SIZE)
@@ -193,13 +675,19 @@ class PlayerCharacter:
             new_image = self.animations[self.current_animation][self.current_frame_index]
             self.image = pygame.transform.flip(new_image, self.facing_left, False)
 
-    def update(self):
-        self.x += (self.target_x - self.x) * self.lerp_speed
-        self.y += (self.target_y - self.y) * self.lerp_speed
+    def update(self, position=None):
+        """position: where a SnapshotBuffer places this player now; without one the
+        player eases towards the latest server position."""
+        if position is not None:
+            self.x, self.y = position
+        else:
+            self.x += (self.target_x - self.x) * self.lerp_speed
+            self.y += (self.target_y - self.y) * self.lerp_speed
         self.rect.topleft = (self.x, self.y)
         self.update_animation()
 
     def move(self, keys, walls):
+        """walls is a SpatialGrid of the stage's Wall objects."""
         if self.is_dead: 
             return
         
@@ -218,21 +706,35 @@ class PlayerCharacter:
             self.vy, self.on_ground = JUMP_STRENGTH, False
             self.set_animation('jump')
         
+        # Everything this frame's motion can touch lies within one step of the current rect.
+        nearby_walls = walls.query(self.rect.inflate(2 * self.speed + 2, 2 * max(TERMINAL_VELOCITY, -JUMP_STRENGTH) + 2))
         self.rect.x += dx
-        for wall in walls:
+        for wall in nearby_walls:
             if self.rect.colliderect(wall.rect):
                 if dx > 0: self.rect.right = wall.rect.left
                 elif dx < 0: self.rect.left = wall.rect.right
         
         self.rect.y += self.vy
         self.on_ground = False
-        for wall in walls:
+        for wall in nearby_walls:
             if self.rect.colliderect(wall.rect):
                 if self.vy > 0: self.rect.bottom, self.vy, self.on_ground = wall.rect.top, 0, True
                 elif self.vy < 0: self.rect.top, self.vy = wall.rect.bottom, 0
         
         self.x, self.y = self.rect.x, self.rect.y
-        self.client_interface.set_player_state(self.id, self.x, self.y, self.lives)
+        # Standing still sends nothing, so an idle player's poll is a lone read the server
+        # can answer from its response cache.
+        if not self.sent_positions or self.sent_positions[-1] != (self.x, self.y):
+            self.sent_positions.append((self.x, self.y))
+            self.client_interface.queue_command(f"set_player_state {self.id} {self.x} {self.y}")
+
+    def read_input(self, keys):
+        """Server-authoritative counterpart of move: turns held keys into INPUT_* bits."""
+        buttons = 0
+        if keys[pygame.K_LEFT] or keys[pygame.K_a]: buttons, self.facing_left = buttons | INPUT_LEFT, True
+        if keys[pygame.K_RIGHT] or keys[pygame.K_d]: buttons, self.facing_left = buttons | INPUT_RIGHT, False
+        if keys[pygame.K_UP] or keys[pygame.K_w]: buttons |= INPUT_JUMP
+        return buttons
 
     def update_from_server(self, p_data):
         just_got_hit = p_data['lives'] < self.lives
@@ -246,10 +748,6 @@ class PlayerCharacter:
         self.lives = p_data['lives']
         self.gems_collected = p_data['gems_collected']
         self.at_exit = p_data['at_exit']
-        
-        if self.is_local_player:
-            self.x, self.y = p_data['x'], p_data['y']
-            self.rect.topleft = (self.x, self.y)
 
         if self.is_dead:
             self.set_animation('death')
@@ -264,6 +762,15 @@ class PlayerCharacter:
             else:
                 self.set_animation('idle')
 
+        if self.is_local_player:
+            # Our own reports come back a few frames late; only positions the server chose
+            # itself (spawn, respawn, a new stage) override where we have moved since.
+            if self.is_dead or (p_data['x'], p_data['y']) not in self.sent_positions:
+                self.x, self.y = p_data['x'], p_data['y']
+                self.rect.topleft = (self.x, self.y)
+            if self.is_dead:
+                self.sent_positions.clear()
+
     def draw(self, surface):
         if self.image: surface.blit(self.image, self.rect)
 
@@ -286,11 +793,27 @@ class Wall(GameObject):
         super().__init__(id, x, y, (width, height), image_b64, GREY)
 
 
+def build_static_layer(background, objects):
+    """Composites the background and everything that stays put for a whole stage
+    (walls, hazards, exit) into one surface, blitted once per frame."""
+    layer = pygame.Surface((WIDTH, HEIGHT))
+    if pygame.display.get_surface() is not None:
+        layer = layer.convert()
+    if background:
+        layer.blit(background, (0, 0))
+    else:
+        layer.fill(BLACK)
+    for obj in objects:
+        obj.draw(layer)
+    return layer
+
+
 def show_start_screen():
     """Menampilkan layar awal dengan animasi teks."""
+    # Load the rest of the assets while the player is looking at the start screen.
+    assets.preload()
     try:
-        background_img = pygame.image.load('assets/bg/awal.png').convert()
-        background_img = pygame.transform.scale(background_img, (WIDTH, HEIGHT))
+        background_img = assets.image('assets/bg/awal.png', (WIDTH, HEIGHT))
     except pygame.error as e:
         print(f"Error memuat background awal: {e}")
         background_img = None
@@ -327,36 +850,39 @@ def show_start_screen():
         clock.tick(FPS)
 
 
-def show_lobby_screen(client_interface):
+def show_lobby_screen(network):
     try:
-        background_img = pygame.image.load('assets/bg/choose_player.png').convert()
-        background_img = pygame.transform.scale(background_img, (WIDTH, HEIGHT))
+        background_img = assets.image('assets/bg/choose_player.png', (WIDTH, HEIGHT))
     except pygame.error as e:
         print(f"Error memuat background pilih karakter: {e}")
         background_img = None
         
-    error_message, cooldown, my_pid = "", 0, None
+    error_message, cooldown, my_pid, registration = "", 0, None, None
     while True:
         for event in pygame.event.get():
             if event.type == pygame.QUIT: pygame.quit(); sys.exit()
-            if event.type == pygame.KEYDOWN and cooldown <= 0 and not my_pid:
+            if event.type == pygame.KEYDOWN and cooldown <= 0 and not my_pid and not registration:
                 color = "black" if event.key == pygame.K_b else "white" if event.key == pygame.K_w else None
                 if color:
-                    response = client_interface.register_player(color)
-                    if response and response['status'] == 'OK':
-                        my_pid, error_message = response['player_id'], ""
-                    else:
-                        error_message, cooldown = response.get('message', 'Failed'), 120
+                    registration = network.submit(f"register_player {color}")
+
+        if registration and registration.done():
+            response = registration.result()
+            registration = None
+            if response and response['status'] == 'OK':
+                my_pid, error_message = response['player_id'], ""
+            else:
+                error_message, cooldown = response.get('message', 'Failed'), 120
 
         if background_img:
             screen.blit(background_img, (0, 0))
         else:
             screen.fill(BLACK)
         
-        state = client_interface.get_game_state()
+        state = network.snapshot
 
-        if state['status'] != 'OK':
-            err_text = font_medium.render(state['message'], True, RED)
+        if state is None or network.error:
+            err_text = font_medium.render(network.error or "Connecting...", True, RED if network.error else WHITE)
             screen.blit(err_text, err_text.get_rect(center=(WIDTH // 2, HEIGHT // 2)))
         else:
             players = state.get('players', {})
@@ -379,7 +905,7 @@ def show_lobby_screen(client_interface):
                 
             if b_taken and w_taken:
                 pygame.display.flip(); time.sleep(1)
-                final_state = client_interface.get_game_state()
+                final_state = network.snapshot
                 my_data = next(((pid, p['color_type']) for pid, p in final_state['players'].items() if pid == my_pid), None)
                 if my_data: return my_data
                 all_ids = list(final_state['players'].keys())
@@ -391,55 +917,93 @@ def show_lobby_screen(client_interface):
         pygame.display.flip(); clock.tick(FPS)
 
 
-def main_game_loop():
-
-    try:
-        pygame.mixer.music.load('assets/sound/Main_music.mp3')
-        pygame.mixer.music.set_volume(0.3) 
-        pygame.mixer.music.play(loops=-1)
-    except pygame.error as e:
-        print(f"Peringatan: Tidak bisa memuat file musik latar. Error: {e}")
+def join_match(network, color):
+    """Headless counterpart of show_lobby_screen: registers as color, then waits until
+    both characters are taken."""
+    response = network.submit(f"register_player {color}").result()
+    if response.get('status') != 'OK':
+        raise RuntimeError(response.get('message', 'Failed to register'))
+    while True:
+        state = network.snapshot
+        if state is not None and {p['color_type'] for p in state['players'].values()} >= {'black', 'white'}:
+            return response['player_id'], color
+        time.sleep(network.poll_interval)
+
+
+def main_game_loop(room=None, dirty_rects=False, update_rate=FPS, color='black', input_source=None,
+                   frame_rate=FPS, max_frames=None):
+    """dirty_rects: only push the areas that changed to the display each frame
+    (pygame.display.update) instead of flipping the whole window.
+    update_rate: state polls per second; remote players are interpolated in between.
+
+    After setup(headless_mode=True) nothing is drawn or played: the client joins as color
+    right away, reads its keys from input_source(local_player, state) (anything indexable
+    like pygame.key.get_pressed()), runs at most frame_rate frames per second (0: as fast
+    as it can) and returns the match winner when the match ends or after max_frames."""
+    setup()
+    if not headless:
+        try:
+            pygame.mixer.music.load(assets.path('assets/sound/Main_music.mp3'))
+            pygame.mixer.music.set_volume(0.3) 
+            pygame.mixer.music.play(loops=-1)
+        except pygame.error as e:
+            print(f"Peringatan: Tidak bisa memuat file musik latar. Error: {e}")
+        show_start_screen()
 
-    show_start_screen()
-    client_interface = ClientInterface()
-    player_id, player_color = show_lobby_screen(client_interface)
-    local_player = PlayerCharacter(player_id, is_local_player=True, initial_color_choice=player_color)
+    network = NetworkWorker(ClientInterface(room), poll_interval=1 / update_rate).start()
+    server_info_request = network.submit("get_server_info")
+    player_id, player_color = join_match(network, color) if headless else show_lobby_screen(network)
+    local_player = PlayerCharacter(player_id, is_local_player=True, initial_color_choice=player_color, client_interface=network)
     other_players, wall_objects, gem_objects, hazard_objects = {}, {}, {}, {}
+    wall_grid, gem_grid = SpatialGrid(), SpatialGrid()
     exit_object, images_b64, match_ended, match_win_status, last_stage = None, {}, False, "", 0
+    level_version, applied_state, predicted_gems = None, None, set()
+    snapshots = SnapshotBuffer(delay=max(INTERPOLATION_DELAY, 2 / update_rate))
+    server_info = server_info_request.result()
+    server_simulates = server_info.get('status') == 'OK' and server_info.get('simulation_hz', 0) > 0
+    last_buttons = 0
     current_bg_image = None
     stage_win_sound_played = False
+    static_layer, drawn_rects, full_redraw = None, [], True
+    stage_overlay = pygame.Surface((WIDTH, HEIGHT))
+    stage_overlay.set_alpha(150)
+    stage_overlay.fill((0, 0, 0))
 
-    try:
-        dog_treat_img = pygame.image.load('assets/ingame_interaction/dogtreats.png').convert_alpha()
-        cat_treat_img = pygame.image.load('assets/ingame_interaction/cattreats.png').convert_alpha()
-        exit_cave_img = pygame.image.load('assets/ingame_interaction/cavehome.png').convert_alpha()
-    except pygame.error as e:
-        print(f"Peringatan: Tidak bisa memuat gambar treats/exit. Error: {e}")
-        dog_treat_img = None
-        cat_treat_img = None
-        exit_cave_img = None
-
+    dog_treat_img = cat_treat_img = exit_cave_img = None
     end_screen_images = {}
-    try:
-        dog_wins_img = pygame.image.load('assets/bg/dogwins.png').convert()
-        cat_wins_img = pygame.image.load('assets/bg/catwins.png').convert()
-        end_screen_images['player_black'] = pygame.transform.scale(dog_wins_img, (WIDTH, HEIGHT))
-        end_screen_images['player_white'] = pygame.transform.scale(cat_wins_img, (WIDTH, HEIGHT))
-    except pygame.error as e:
-        print(f"Peringatan: Gagal memuat gambar layar akhir. Error: {e}")
+    if not headless:
+        try:
+            dog_treat_img = assets.image('assets/ingame_interaction/dogtreats.png', GEM_SIZE, alpha=True)
+            cat_treat_img = assets.image('assets/ingame_interaction/cattreats.png', GEM_SIZE, alpha=True)
+            exit_cave_img = assets.image('assets/ingame_interaction/cavehome.png', alpha=True)
+        except pygame.error as e:
+            print(f"Peringatan: Tidak bisa memuat gambar treats/exit. Error: {e}")
 
-    running = True
+        try:
+            end_screen_images['player_black'] = assets.image('assets/bg/dogwins.png', (WIDTH, HEIGHT))
+            end_screen_images['player_white'] = assets.image('assets/bg/catwins.png', (WIDTH, HEIGHT))
+        except pygame.error as e:
+            print(f"Peringatan: Gagal memuat gambar layar akhir. Error: {e}")
+
+    running, frame, game_info = True, 0, {}
     while running:
+        dirty_update = None
         for event in pygame.event.get():
             if event.type == pygame.QUIT: running = False
+        frame += 1
+        if max_frames is not None and frame > max_frames:
+            break
             
-        state = client_interface.get_game_state()
-        if not (state and state['status'] == 'OK'):
-            # time.sleep(1); 
+        # Always the newest complete state the network thread has; it may be a few frames old.
+        state = network.snapshot
+        if state is None:
+            clock.tick(frame_rate)
             continue
             
         game_info = state['game_info']
         if game_info['match_winner'] and not match_ended:
+            if headless:
+                break
             pygame.mixer.music.fadeout(2000)
 
             if local_player.winmatch:
@@ -451,110 +1015,141 @@ def main_game_loop():
             end_image = end_screen_images.get(winner_id)
             if end_image:
                 screen.blit(end_image, (0,0))
-            
-            pygame.display.flip()
+            full_redraw = True
 
             keys = pygame.key.get_pressed()
             if keys[pygame.K_q]: running = False
             if keys[pygame.K_r]:
-                client_interface.reset_game() 
+                network.submit("reset_game").result()
+                network.stop()
                 time.sleep(0.5)
                 stage_win_sound_played = False
-                main_game_loop()
+                main_game_loop(room, dirty_rects, update_rate, color=color, input_source=input_source,
+                               frame_rate=frame_rate, max_frames=max_frames)
                 return
         else:
             current_stage = game_info['current_stage']
             if current_stage != last_stage:
                 logging.info(f"--- Entering Stage {current_stage} ---")
-                gem_objects.clear(); hazard_objects.clear(); wall_objects.clear(); exit_object = None
                 last_stage = current_stage
                 stage_win_sound_played = False
                 try:
                     filepath = f'assets/bg/background {current_stage}.png'
                     logging.info(f"Loading background: {filepath}")
-                    loaded_image = pygame.image.load(filepath).convert()
-                    current_bg_image = pygame.transform.scale(loaded_image, (WIDTH, HEIGHT))
+                    current_bg_image = None if headless else assets.image(filepath, (WIDTH, HEIGHT))
                 except Exception as e:
                     logging.error(f"Error loading background for stage {current_stage}: {e}")
                     current_bg_image = None
+                static_layer = None
             
-            p_ids = set(state['players'].keys())
-            for p_id, p_data in state['players'].items():
-                if p_id == local_player.id: local_player.update_from_server(p_data)
-                else:
-                    if p_id not in other_players: other_players[p_id] = PlayerCharacter(p_id, initial_color_choice=p_data['color_type'])
-                    other_players[p_id].update_from_server(p_data)
-            for p_id in list(other_players.keys()):
-                if p_id not in p_ids: del other_players[p_id]
-            
-            if not images_b64: images_b64 = state.get('images', {})
-            
-            if not wall_objects and state.get('walls'):
-                for w in state['walls']: wall_objects[w['id']] = Wall(w['id'], w['x'], w['y'], w['width'], w['height'], images_b64.get('wall'))
-            if not hazard_objects and state.get('hazards'):
-                for h in state['hazards']: hazard_objects[h['id']] = Hazard(h['id'], h['x'], h['y'], h['type'], h['width'], h['height'], images_b64.get(f"{h['type']}_hazard"))
-            
-            g_ids = {g['id'] for g in state['gems']}
-            for g_id in list(gem_objects.keys()):
-                if g_id not in g_ids: del gem_objects[g_id]
-            for g in state['gems']:
-                if g['id'] not in gem_objects:
-                    new_gem = Gem(g['id'], g['x'], g['y'], g['type'], images_b64.get(f"{g['type']}_gem"))
-        
-                    if new_gem.gem_type == 'black' and dog_treat_img:
-                        new_gem.image = pygame.transform.scale(dog_treat_img, GEM_SIZE)
-                    elif new_gem.gem_type == 'white' and cat_treat_img:
-                        new_gem.image = pygame.transform.scale(cat_treat_img, GEM_SIZE)
-                    
-                    gem_objects[g['id']] = new_gem
-            
-            if not exit_object and state.get('exit_area'):
-                e = state['exit_area']
+            if state['level_version'] != level_version:
+                level = state['level']
+                level_version = level['level_version']
+                images_b64 = level.get('images', {})
+                gem_objects.clear(); hazard_objects.clear(); wall_objects.clear()
+                gem_grid.clear(); wall_grid.clear()
+                for w in level['walls']: wall_objects[w['id']] = Wall(w['id'], w['x'], w['y'], w['width'], w['height'], images_b64.get('wall'))
+                for h in level['hazards']: hazard_objects[h['id']] = Hazard(h['id'], h['x'], h['y'], h['type'], h['width'], h['height'], images_b64.get(f"{h['type']}_hazard"))
+                for w in wall_objects.values(): wall_grid.insert(w)
+                e = level['exit_area']
                 exit_object = ExitArea(e['x'], e['y'], e['width'], e['height'], images_b64.get('exit'))
                 if exit_cave_img:
-                    exit_object.image = pygame.transform.scale(exit_cave_img, (e['width'], e['height']))
+                    exit_object.image = assets.image('assets/ingame_interaction/cavehome.png', (e['width'], e['height']), alpha=True)
+                static_layer = None
+                predicted_gems.clear()
+                snapshots.clear()
+
+            # Snapshots are complete, so a new one is applied by syncing to it; between
+            # network updates the previous one just keeps being drawn.
+            if state is not applied_state:
+                applied_state = state
+                snapshots.push(state['server_time'], state['received_at'], state['players'])
+                server_gems = state['gems']
+                for g_id in list(gem_objects.keys()):
+                    if g_id not in server_gems: gem_grid.remove(gem_objects.pop(g_id))
+                # Treats we already hid locally stay hidden until the server catches up.
+                predicted_gems &= server_gems.keys()
+
+                for p_id, p_data in state['players'].items():
+                    if p_id == local_player.id: local_player.update_from_server(p_data)
+                    else:
+                        if p_id not in other_players: other_players[p_id] = PlayerCharacter(p_id, initial_color_choice=p_data['color_type'])
+                        other_players[p_id].update_from_server(p_data)
+                for p_id in list(other_players.keys()):
+                    if p_id not in state['players']: del other_players[p_id]
+
+                for g_id, g in server_gems.items():
+                    if g_id not in gem_objects and g_id not in predicted_gems:
+                        new_gem = Gem(g_id, g['x'], g['y'], g['type'], images_b64.get(f"{g['type']}_gem"))
+            
+                        if new_gem.gem_type == 'black' and dog_treat_img:
+                            new_gem.image = dog_treat_img
+                        elif new_gem.gem_type == 'white' and cat_treat_img:
+                            new_gem.image = cat_treat_img
+                        
+                        gem_objects[g_id] = new_gem
+                        gem_grid.insert(new_gem)
             
             if game_info['stage_winner'] and not stage_win_sound_played:
-                local_player.Stagewin.play()
+                if local_player.Stagewin:
+                    local_player.Stagewin.play()
                 stage_win_sound_played = True
 
             if not game_info['stage_winner']:
-                keys = pygame.key.get_pressed()
-                local_player.move(keys, list(wall_objects.values()))
+                keys = input_source(local_player, state) if input_source else pygame.key.get_pressed()
+                if server_simulates:
+                    buttons = local_player.read_input(keys)
+                    if buttons != last_buttons:
+                        network.queue_command(f"player_input {local_player.id} {buttons}")
+                        last_buttons = buttons
+                else:
+                    local_player.move(keys, wall_grid)
+                # Pickups, hazards and the exit are resolved by the server from the position we
+                # send; we only hide a picked-up treat right away instead of waiting for the diff.
                 if local_player.lives > 0:
-                    for g_id, gem in list(gem_objects.items()):
+                    for gem in gem_grid.query(local_player.rect):
                         if local_player.rect.colliderect(gem.rect) and gem.gem_type == local_player.color_type:
-                            client_interface.collect_gem(local_player.id, g_id)
+                            gem_grid.remove(gem)
+                            del gem_objects[gem.id]
+                            predicted_gems.add(gem.id)
                             if local_player.get_gem_sound:
                                 local_player.get_gem_sound.play()
-                            # del gem_objects[g_id]
-                            break
-                    for h_id, hazard in hazard_objects.items():
-                        if local_player.rect.colliderect(hazard.rect) and hazard.hazard_type != local_player.color_type:
-                            client_interface.check_hazard_collision(local_player.id, h_id)
-                            break
-                    if exit_object and local_player.rect.colliderect(exit_object.rect) and not local_player.at_exit:
-                        client_interface.player_at_exit(local_player.id)
 
 
             local_player.update_animation()
-            for p in other_players.values(): p.update() 
-
-            if current_bg_image:
-                screen.blit(current_bg_image, (0, 0))
+            remote_positions = snapshots.positions(time.monotonic())
+            for p_id, p in other_players.items(): p.update(remote_positions.get(p_id))
+
+            if headless:
+                clock.tick(frame_rate)
+                continue
+
+            if static_layer is None:
+                static_layer = build_static_layer(current_bg_image, [*wall_objects.values(), *hazard_objects.values(),
+                                                                     *([exit_object] if exit_object else [])])
+                full_redraw = True
+
+            # In dirty-rect mode only last frame's sprites and HUD are painted over from the
+            # static layer; otherwise (and after any full-screen change) the whole layer is.
+            redraw_all, full_redraw = full_redraw or not dirty_rects, False
+            if redraw_all:
+                screen.blit(static_layer, (0, 0))
             else:
-                screen.fill(BLACK)
+                for r in drawn_rects: screen.blit(static_layer, r, r)
+            previous_rects, drawn_rects = drawn_rects, []
 
-            for w in wall_objects.values(): w.draw(screen)
-            for h in hazard_objects.values(): h.draw(screen)
-            for g in gem_objects.values(): g.draw(screen)
-            if exit_object: exit_object.draw(screen)
+            for g in gem_objects.values():
+                g.draw(screen)
+                drawn_rects.append(g.rect)
             local_player.draw(screen)
-            for p in other_players.values(): p.draw(screen)
+            drawn_rects.append(local_player.rect.copy())
+            for p in other_players.values():
+                p.draw(screen)
+                drawn_rects.append(p.rect.copy())
             
             scores = game_info['scores']
             score_text = font_ingame.render(f"Skor: Dog {scores['player_black']} - Cat {scores['player_white']}", True, WHITE)
-            screen.blit(score_text, (10, 10))
+            drawn_rects.append(screen.blit(score_text, (10, 10)))
             
             required_gems_map = game_info.get('required_gems', {})
             player_color_type = local_player.color_type
@@ -562,49 +1157,68 @@ def main_game_loop():
                 collected = local_player.gems_collected
                 required = required_gems_map[player_color_type]
                 gem_status_text = font_ingame.render(f"Treats: {collected}/{required}", True, WHITE)
-                screen.blit(gem_status_text, (10, 40))
+                drawn_rects.append(screen.blit(gem_status_text, (10, 40)))
 
             lives_text = font_ingame.render(f"Lives: {local_player.lives}", True, RED)
-            screen.blit(lives_text, (10, 70))
+            drawn_rects.append(screen.blit(lives_text, (10, 70)))
 
             stage_text = font_ingame.render(f"Stage: {game_info['current_stage']}/{game_info['total_stages']}", True, WHITE)
-            screen.blit(stage_text, (WIDTH - stage_text.get_width() - 10, 10))
+            drawn_rects.append(screen.blit(stage_text, (WIDTH - stage_text.get_width() - 10, 10)))
             elapsed_time = game_info['elapsed_time']
             mins, secs = int(elapsed_time // 60), int(elapsed_time % 60)
             stopwatch_text = font_small.render(f"{mins:02d}:{secs:02d}", True, WHITE)
-            screen.blit(stopwatch_text, (WIDTH // 2 - stopwatch_text.get_width() // 2, 10))
+            drawn_rects.append(screen.blit(stopwatch_text, (WIDTH // 2 - stopwatch_text.get_width() // 2, 10)))
             
             if game_info['stage_winner']:
-                overlay = pygame.Surface((WIDTH, HEIGHT))
-                overlay.set_alpha(150)  
-                overlay.fill((0, 0, 0))  
-
                 winner_is_dog = "black" in game_info['stage_winner']
-                screen.blit(overlay, (0, 0))
+                screen.blit(stage_overlay, (0, 0))
                 image_path = "assets/bg/dog_win_stage.png" if winner_is_dog else "assets/bg/cat_win_stage.png"
-                win_image = pygame.image.load(image_path).convert_alpha()
-                
-                image_width, image_height = win_image.get_width(), win_image.get_height()
-                win_image = pygame.transform.smoothscale(win_image, (image_width * 0.8 , image_height * 0.8))
+                win_image = assets.image(image_path, alpha=True, scale=0.8, smooth=True)
                 
                 screen.blit(win_image, win_image.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 60)))
+                redraw_all = full_redraw = True
+
+            if not redraw_all:
+                dirty_update = previous_rects + drawn_rects
         
-        pygame.display.flip()
-        clock.tick(FPS)
+        if dirty_update is not None:
+            pygame.display.update(dirty_update)
+        else:
+            pygame.display.flip()
+        clock.tick(frame_rate)
         
+    network.stop()
+    if headless:
+        return game_info.get('match_winner')
     pygame.quit()
     sys.exit()
 
 
 if __name__ == "__main__":
     try:
-        main_game_loop()
+        parser = argparse.ArgumentParser(description="Game of Bones client")
+        parser.add_argument('room', nargs='?', default=None, help="match to join on the server (default: the server's default match)")
+        parser.add_argument('--dirty-rects', action='store_true', help="only redraw the parts of the window that changed")
+        parser.add_argument('--update-rate', type=float, default=FPS, help=f"state updates requested per second (default: {FPS})")
+        parser.add_argument('--headless', action='store_true',
+                            help="no window, sound or assets: join as --color and run the game logic only")
+        parser.add_argument('--color', choices=('black', 'white'), default='black', help="character to join as with --headless")
+        parser.add_argument('--frame-rate', type=float, default=None,
+                            help=f"frames per second (default: {FPS}, or as fast as possible with --headless)")
+        parser.add_argument('--frames', type=int, default=None, help="stop after this many frames")
+        args = parser.parse_args()
+        setup(args.headless)
+        frame_rate = args.frame_rate if args.frame_rate is not None else 0 if args.headless else FPS
+        winner = main_game_loop(args.room, args.dirty_rects, args.update_rate, color=args.color,
+                                frame_rate=frame_rate, max_frames=args.frames)
+        logging.warning(f"Headless client finished, match winner: {winner}")
     except Exception as e:
         print("\n!!! TERJADI ERROR PADA APLIKASI CLIENT !!!")
         print(f"Error: {e}")
         import traceback
         traceback.print_exc()
     finally:
-        input("\Press Enter untuk keluar...")
+        if not headless:
+            input("\Press Enter untuk keluar...")
         pygame.quit()
         sys.exit()
@@ -1,48 +1,93 @@
 from socket import *
 import socket
+import selectors
 import threading
+import multiprocessing
 import logging
+import argparse
+import time
+from collections import deque
 
-from http_handler import HttpServer
+from http_handler import HttpServer, RoutingHttpServer
+from http_parser import RequestParser, HttpParseError
+from static_files import FileBody, FileResponse
+import server_log
+import metrics
 
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
 
 httpserver = HttpServer()
 
+# A keep-alive connection that stays silent this long is closed by the server.
+IDLE_TIMEOUT = 30
+
+def client_name(address):
+    return f"{address[0]}:{address[1]}"
+
+def log_request(address, request, size):
+    server_log.event('request', "Request handled", client=client_name(address),
+                     request=request.head.split('\r\n', 1)[0], bytes=size)
+
 class ProcessTheClient(threading.Thread):
-    def __init__(self, connection, address):
+    def __init__(self, connection, address, http_server=None):
         self.connection = connection
         self.address = address
+        self.http_server = http_server or httpserver
         threading.Thread.__init__(self)
 
     def run(self):
-        rcv = ""
-        while True:
+        parser = RequestParser()
+        metrics.CONNECTIONS_OPENED.inc()
+        self.connection.settimeout(IDLE_TIMEOUT)
+        keep_alive = True
+        while keep_alive:
             try:
-                data = self.connection.recv(1024)
-                if data:
-                    d = data.decode('utf-8')
-                    rcv += d
-                    
-                    if rcv.endswith('\r\n\r\n'):
-                        logging.warning(f"Data from client {self.address}: {rcv.strip()}")
-                        
-                        hasil = httpserver.proses(rcv)
-                        
-                        logging.warning(f"Response to client {self.address}: OK")
-                        self.connection.sendall(hasil)
-                        break
-                else:
+                data = self.connection.recv(4096)
+                if not data:
                     break
+                parser.feed(data)
+                # Pipelined requests are answered one after another, in the order they came.
+                for request in parser:
+                    hasil = self.http_server.handle(request)
+                    keep_alive = request.keep_alive
+
+                    # Taken first: sending a FileResponse consumes its body.
+                    size = len(hasil)
+                    self._send(hasil)
+                    if server_log.sampled('request'):
+                        log_request(self.address, request, size)
+                    if not keep_alive:
+                        break
+            except HttpParseError as e:
+                server_log.error('bad_request', "Bad request", client=client_name(self.address), error=str(e))
+                try:
+                    self.connection.sendall(self.http_server.error_response(e))
+                except OSError:
+                    pass
+                break
+            except socket.timeout:
+                break
             except Exception as e:
-                logging.error(f"Error with client {self.address}: {e}")
+                server_log.error('connection', "Error with client", client=client_name(self.address), error=str(e))
                 break
         self.connection.close()
+        metrics.CONNECTIONS_CLOSED.inc()
+
+    def _send(self, hasil):
+        if not isinstance(hasil, FileResponse):
+            self.connection.sendall(hasil)
+            return
+        try:
+            self.connection.sendall(hasil.head)
+            hasil.body.send_all(self.connection)
+        finally:
+            hasil.body.close()
 
 class Server(threading.Thread):
-    def __init__(self, port=8889):
+    def __init__(self, port=8889, http_server=None):
         self.the_clients = []
         self.port = port
+        self.http_server = http_server or httpserver
         self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         threading.Thread.__init__(self)
@@ -55,16 +100,234 @@ class Server(threading.Thread):
         while True:
             try:
                 connection, client_address = self.my_socket.accept()
-                logging.warning(f"Connection from {client_address}")
-                clt = ProcessTheClient(connection, client_address)
+                if server_log.sampled('connection'):
+                    server_log.event('connection', "Connection accepted", client=client_name(client_address))
+                clt = ProcessTheClient(connection, client_address, self.http_server)
                 clt.start()
+                self.the_clients = [c for c in self.the_clients if c.is_alive()]
                 self.the_clients.append(clt)
             except Exception as e:
-                logging.error(f"Server error: {e}")
+                server_log.error('server', "Server error", error=str(e))
                 break
 
+class EventLoopServer:
+    """Single-threaded server that multiplexes every connection with selectors,
+    so the number of open sockets no longer dictates the number of threads."""
+
+    def __init__(self, port=8889, http_server=None):
+        self.port = port
+        self.http_server = http_server or httpserver
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def start(self):
+        self.run()
+
+    def run(self):
+        self.my_socket.bind(('0.0.0.0', self.port))
+        self.my_socket.listen(128)
+        self.my_socket.setblocking(False)
+        self.selector.register(self.my_socket, selectors.EVENT_READ)
+        logging.warning(f"Event loop server running on port {self.port}...")
+
+        last_sweep = time.monotonic()
+        while True:
+            for key, mask in self.selector.select(timeout=1.0):
+                if key.fileobj is self.my_socket:
+                    self._accept()
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self._read(key.fileobj)
+                if mask & selectors.EVENT_WRITE and key.fileobj in self.connections:
+                    self._write(key.fileobj)
+
+            now = time.monotonic()
+            if now - last_sweep >= 1.0:
+                last_sweep = now
+                for connection, state in list(self.connections.items()):
+                    if now - state['last_active'] > IDLE_TIMEOUT:
+                        self._close(connection)
+
+    def _accept(self):
+        try:
+            connection, client_address = self.my_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as e:
+            server_log.error('server', "Server error", error=str(e))
+            return
+        if server_log.sampled('connection'):
+            server_log.event('connection', "Connection accepted", client=client_name(client_address))
+        connection.setblocking(False)
+        metrics.CONNECTIONS_OPENED.inc()
+        self.connections[connection] = {
+            'address': client_address, 'parser': RequestParser(), 'out': deque(),
+            'closing': False, 'last_active': time.monotonic(),
+        }
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def _read(self, connection):
+        state = self.connections[connection]
+        try:
+            data = connection.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as e:
+            server_log.error('connection', "Error with client", client=client_name(state['address']), error=str(e))
+            self._close(connection)
+            return
+        if not data:
+            self._close(connection)
+            return
+
+        state['last_active'] = time.monotonic()
+        parser = state['parser']
+        parser.feed(data)
+        while not state['closing']:
+            try:
+                request = parser.next_request()
+            except HttpParseError as e:
+                server_log.error('bad_request', "Bad request", client=client_name(state['address']), error=str(e))
+                self._queue(state, self.http_server.error_response(e))
+                state['closing'] = True
+                break
+            if request is None:
+                break
+            try:
+                hasil = self.http_server.handle(request)
+            except Exception as e:
+                # One failing request must not take the loop, and every other connection, down with it.
+                server_log.error('handler', "Error handling request", client=client_name(state['address']),
+                                 request=request.head.split('\r\n', 1)[0], error=repr(e))
+                self._queue(state, self.http_server.response(500, 'Internal Server Error', b'', {}))
+                state['closing'] = True
+                break
+
+            size = len(hasil)
+            self._queue(state, hasil)
+            if server_log.sampled('request'):
+                log_request(state['address'], request, size)
+            if not request.keep_alive:
+                state['closing'] = True
+        if state['out']:
+            self._write(connection)
+
+    def _queue(self, state, hasil):
+        # 'out' holds bytearrays and FileBody objects still to be written, in response order.
+        out = state['out']
+        if isinstance(hasil, FileResponse):
+            self._queue(state, hasil.head)
+            out.append(hasil.body)
+        elif out and isinstance(out[-1], bytearray):
+            out[-1] += hasil
+        else:
+            out.append(bytearray(hasil))
+
+    def _write(self, connection):
+        state = self.connections[connection]
+        out = state['out']
+        progressed = False
+        try:
+            while out:
+                chunk = out[0]
+                if isinstance(chunk, FileBody):
+                    chunk.send(connection)
+                    progressed = True
+                    if chunk.remaining:
+                        continue
+                    chunk.close()
+                else:
+                    sent = connection.send(chunk)
+                    progressed = True
+                    del chunk[:sent]
+                    if chunk:
+                        continue
+                out.popleft()
+        except (BlockingIOError, InterruptedError):
+            pass
+        except Exception as e:
+            server_log.error('connection', "Error with client", client=client_name(state['address']), error=str(e))
+            self._close(connection)
+            return
+        if progressed:
+            # A client still slowly downloading a response is not idle, even if it sends nothing.
+            state['last_active'] = time.monotonic()
+
+        if state['out']:
+            self.selector.modify(connection, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        elif state['closing']:
+            self._close(connection)
+        else:
+            self.selector.modify(connection, selectors.EVENT_READ)
+
+    def _close(self, connection):
+        state = self.connections.pop(connection, None)
+        if state:
+            metrics.CONNECTIONS_CLOSED.inc()
+            for chunk in state['out']:
+                if isinstance(chunk, FileBody): chunk.close()
+        try:
+            self.selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
+
+
+SERVER_MODES = {'thread': Server, 'eventloop': EventLoopServer}
+
+
+def run_worker(mode, port, tick_rate, log_mode='async', sample_rates=None):
+    server_log.setup(log_mode, sample_rates)
+    if tick_rate > 0:
+        httpserver.rooms.start_simulation(tick_rate)
+    SERVER_MODES[mode](port=port).run()
+
+
+def run_sharded(mode, port, tick_rate, workers, log_mode='async', sample_rates=None):
+    """Starts one worker process per shard on port+1..port+workers. The process on port
+    redirects each game request to the worker owning its room (see worker_for_room),
+    so every match lives in exactly one process and matches spread across cores."""
+    worker_ports = [port + 1 + i for i in range(workers)]
+    processes = []
+    for worker_port in worker_ports:
+        process = multiprocessing.Process(target=run_worker, args=(mode, worker_port, tick_rate, log_mode, sample_rates), daemon=True)
+        process.start()
+        processes.append(process)
+    logging.warning(f"Started {workers} workers on ports {worker_ports[0]}-{worker_ports[-1]}")
+
+    EventLoopServer(port=port, http_server=RoutingHttpServer(worker_ports)).run()
+
 def main():
-    svr = Server(port=8889)
+    parser = argparse.ArgumentParser(description="Game of Bones HTTP game server")
+    parser.add_argument('--port', type=int, default=8889)
+    parser.add_argument('--mode', choices=sorted(SERVER_MODES), default='thread',
+                        help="thread: one thread per connection; eventloop: single-threaded selectors loop")
+    parser.add_argument('--tick-rate', type=int, default=0,
+                        help="run the server-authoritative simulation at this many Hz (0: clients simulate)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes; with more than one, rooms are sharded across them")
+    parser.add_argument('--log', choices=server_log.LOG_MODES, default='async',
+                        help="async: a background thread writes the log; sync: written by the thread logging")
+    parser.add_argument('--log-sample', action='append', default=[], metavar='CATEGORY=N',
+                        help="write 1 in N records of a category (request, connection; 0 turns it off)")
+    args = parser.parse_args()
+
+    try:
+        sample_rates = dict(server_log.parse_sample_rate(text) for text in args.log_sample)
+    except ValueError as e:
+        parser.error(str(e))
+    server_log.setup(args.log, sample_rates)
+
+    if args.workers > 1:
+        run_sharded(args.mode, args.port, args.tick_rate, args.workers, args.log, sample_rates)
+        return
+
+    if args.tick_rate > 0:
+        httpserver.rooms.start_simulation(args.tick_rate)
+
+    svr = SERVER_MODES[args.mode](port=args.port)
     svr.start()
 
 if __name__ == "__main__":
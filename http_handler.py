@@ -1,8 +1,17 @@
 import os.path
+import json
+import time
+from urllib.parse import unquote
 from glob import glob
 from datetime import datetime
 
-from protocol import PlayerServerProtocol
+from protocol import COMMANDS
+from http_parser import header_value
+from static_files import StaticFileCache, FileBody, FileResponse
+import static_files
+from room_manager import RoomManager, DEFAULT_ROOM, worker_for_room
+import wire_format
+import metrics
 
 class HttpServer:
     def __init__(self):
@@ -12,76 +21,178 @@ class HttpServer:
         self.types['.jpg'] = 'image/jpeg'
         self.types['.txt'] = 'text/plain'
         self.types['.html'] = 'text/html'
+        self.types['.png'] = 'image/png'
+        self.types['.wav'] = 'audio/wav'
+        self.types['.mp3'] = 'audio/mpeg'
+        self.types['.ttf'] = 'font/ttf'
+        self.types['.json'] = 'application/json'
         
-        self.game_protocol = PlayerServerProtocol()
+        # Static files: /assets/<path> is served from the assets/ tree and nothing outside it.
+        self.static_prefix = '/assets/'
+        self.static_root = os.path.abspath('assets')
+        self.static_cache = StaticFileCache()
+        self._date_cache = (None, '')
+        self.rooms = RoomManager()
+        self.game_protocol = self.rooms.default
 
-    def response(self, kode=404, message='Not Found', messagebody=b'', headers={}):
-        tanggal = datetime.now().strftime('%c')
+    def response(self, kode=404, message='Not Found', messagebody=b'', headers={}, keep_alive=False):
+        if not isinstance(messagebody, bytes):
+            messagebody = messagebody.encode()
+
+        return self.response_head(kode, message, len(messagebody), headers, keep_alive) + messagebody
+
+    def response_head(self, kode, message, content_length, headers={}, keep_alive=False):
+        tanggal = self.http_date()
         resp = []
-        resp.append(f"HTTP/1.0 {kode} {message}\r\n")
+        resp.append(f"HTTP/1.1 {kode} {message}\r\n")
         resp.append(f"Date: {tanggal}\r\n")
-        resp.append("Connection: close\r\n")
+        resp.append("Connection: keep-alive\r\n" if keep_alive else "Connection: close\r\n")
         resp.append("Server: myserver/1.0\r\n")
-        resp.append(f"Content-Length: {len(messagebody)}\r\n")
+        resp.append(f"Content-Length: {content_length}\r\n")
         for kk in headers:
             resp.append(f"{kk}:{headers[kk]}\r\n")
         resp.append("\r\n")
 
         response_headers = "".join(resp)
-        
-        if not isinstance(messagebody, bytes):
-            messagebody = messagebody.encode()
 
-        return response_headers.encode() + messagebody
+        return response_headers.encode()
 
-    def proses(self, data):
-        requests = data.split("\r\n")
-        baris = requests[0]
-        all_headers = [n for n in requests[1:] if n]
+    def http_date(self):
+        # Formatted once per second rather than for every response.
+        now = int(time.time())
+        if self._date_cache[0] != now:
+            self._date_cache = (now, datetime.fromtimestamp(now).strftime('%c'))
+        return self._date_cache[1]
 
-        j = baris.split(" ")
-        try:
-            method = j[0].upper().strip()
-            if method == 'GET':
-                object_address = j[1].strip()
-                return self.http_get(object_address, all_headers)
-            elif method == 'POST':
-                object_address = j[1].strip()
-                return self.http_post(object_address, all_headers)
-            else:
-                return self.response(400, 'Bad Request', b'', {})
-        except IndexError:
-            return self.response(400, 'Bad Request', b'', {})
-
-    def http_get(self, object_address, headers):
-        if object_address.startswith('/game/'):
-            command_parts = object_address.split('/')[2:]
-            command_string = " ".join(command_parts)
+    def handle(self, request):
+        """Builds the response bytes for one HttpRequest from http_parser.RequestParser."""
+        if request.method == 'GET':
+            hasil = self.http_get(request.path, request.headers, request.keep_alive)
+        elif request.method == 'POST':
+            hasil = self.http_post(request.path, request.headers, request.keep_alive, request.body)
+        else:
+            hasil = self.response(400, 'Bad Request', b'', {}, request.keep_alive)
+        metrics.RESPONSE_BYTES.observe(len(hasil))
+        return hasil
+
+    def error_response(self, error):
+        """Response for an HttpParseError; the connection is closed after it."""
+        return self.response(error.status, error.reason, b'', {})
+
+    def game_route(self, object_address):
+        """/game/<command>/... targets the default room, /game/<room>/<command>/... a named one."""
+        command_parts = object_address.split('/')[2:]
+        room_id = DEFAULT_ROOM
+        if command_parts and command_parts[0].lower() not in COMMANDS:
+            room_id, command_parts = command_parts[0], command_parts[1:]
+        return room_id, command_parts
+
+    def http_game(self, object_address, headers, keep_alive=False, body=b''):
+        """Runs a game command. GET carries it in the path; a POST body holds the rest of
+        the command (e.g. the sub-commands of a long batch) after the path's words."""
+        room_id, command_parts = self.game_route(object_address)
+        command_string = " ".join(command_parts)
+        if body:
+            try:
+                command_string = f"{command_string} {body.decode('utf-8')}"
+            except UnicodeDecodeError:
+                return self.response(400, 'Bad Request', '', {}, keep_alive)
+        if not command_string.strip():
+            return self.response(400, 'Bad Request', '', {}, keep_alive)
 
-            game_response_json = self.game_protocol.proses_string(command_string)
-            
-            return self.response(200, 'OK', game_response_json, {'Content-Type': 'application/json'})
+        game_protocol = self.rooms.get(room_id)
+        if game_protocol is None:
+            return self.response(503, 'Service Unavailable', json.dumps({"status": "ERROR", "message": "Room unavailable."}), {'Content-Type': wire_format.JSON_CONTENT_TYPE}, keep_alive)
+
+        command = command_string.split(None, 1)[0].lower()
+        start = time.perf_counter()
+        content_type, body = game_protocol.proses_encoded(command_string, wire_format.accepts_binary(headers))
+        # Unknown words are folded into one label so clients cannot create new series.
+        metrics.COMMAND_DURATION.observe(time.perf_counter() - start, command if command in COMMANDS else 'unknown')
+        return self.response(200, 'OK', body, {'Content-Type': content_type}, keep_alive)
+
+    def http_get(self, object_address, headers, keep_alive=False):
+        if object_address.startswith('/game/'):
+            return self.http_game(object_address, headers, keep_alive)
 
+        if object_address == '/metrics':
+            gauges = {'game_rooms_active': ("Rooms open in this process", len(self.rooms.rooms))}
+            return self.response(200, 'OK', metrics.render(gauges), {'Content-Type': metrics.CONTENT_TYPE}, keep_alive)
         if object_address == '/':
-            return self.response(200, 'OK', 'Ini Adalah web Server percobaan', {})
+            return self.response(200, 'OK', 'Ini Adalah web Server percobaan', {}, keep_alive)
         if object_address == '/video':
-            return self.response(302, 'Found', '', {'location': 'https://youtu.be/katoxpnTf04'})
+            return self.response(302, 'Found', '', {'location': 'https://youtu.be/katoxpnTf04'}, keep_alive)
         if object_address == '/santai':
-            return self.response(200, 'OK', 'santai saja', {})
+            return self.response(200, 'OK', 'santai saja', {}, keep_alive)
 
-        object_address = object_address.strip('/')
-        if not os.path.exists(object_address):
-            return self.response(404, 'Not Found', '', {})
-        
-        with open(object_address, 'rb') as fp:
-            isi = fp.read()
-        
-        fext = os.path.splitext(object_address)[1]
+        path = self.static_path(object_address)
+        if path is None:
+            return self.response(404, 'Not Found', '', {}, keep_alive)
+        return self.http_static(path, headers, keep_alive)
+
+    def static_path(self, object_address):
+        """Maps a /assets/ URL path to a file under static_root; None if it is missing or outside it."""
+        url_path = unquote(object_address.split('?', 1)[0])
+        if not url_path.startswith(self.static_prefix):
+            return None
+        relative = url_path[len(self.static_prefix):].strip('/')
+        path = os.path.abspath(os.path.join(self.static_root, relative))
+        if os.path.commonpath([self.static_root, path]) != self.static_root or not os.path.isfile(path):
+            return None
+        return path
+
+    def http_static(self, path, headers, keep_alive=False):
+        """Small files come from static_cache; larger ones are streamed with sendfile.
+        Either way the client can revalidate with If-None-Match / If-Modified-Since."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return self.response(404, 'Not Found', '', {}, keep_alive)
+
+        fext = os.path.splitext(path)[1].lower()
         content_type = self.types.get(fext, 'application/octet-stream')
-        
-        headers = {'Content-type': content_type}
-        return self.response(200, 'OK', isi, headers)
+        validators = {'ETag': static_files.etag(st), 'Last-Modified': static_files.last_modified(st), 'Cache-Control': 'no-cache'}
+        if static_files.not_modified(header_value(headers, 'if-none-match'), header_value(headers, 'if-modified-since'), st):
+            return self.response(304, 'Not Modified', b'', validators, keep_alive)
+
+        isi = self.static_cache.get(path, st)
+        if isi is not None:
+            return self.response(200, 'OK', isi, {'Content-type': content_type, **validators}, keep_alive)
 
-    def http_post(self, object_address, headers):
+        try:
+            fp = open(path, 'rb')
+        except OSError:
+            return self.response(404, 'Not Found', '', {}, keep_alive)
+        # Describe the file we actually opened, in case it changed since the stat above.
+        st = os.fstat(fp.fileno())
+        validators = {'ETag': static_files.etag(st), 'Last-Modified': static_files.last_modified(st), 'Cache-Control': 'no-cache'}
+        headers = {'Content-type': content_type, **validators}
+        if st.st_size <= self.static_cache.max_file_size:
+            with fp:
+                isi = fp.read()
+            self.static_cache.put(path, st, isi)
+            return self.response(200, 'OK', isi, headers, keep_alive)
+        return FileResponse(self.response_head(200, 'OK', st.st_size, headers, keep_alive), FileBody(fp, st.st_size))
+
+    def http_post(self, object_address, headers, keep_alive=False, body=b''):
+        if object_address.startswith('/game/'):
+            return self.http_game(object_address, headers, keep_alive, body)
         isi = "kosong"
-        return self.response(200, 'OK', isi, {})
+        return self.response(200, 'OK', isi, {}, keep_alive)
+
+
+class RoutingHttpServer(HttpServer):
+    """Front end of a sharded server: game requests are redirected to the worker process
+    that owns their room, everything else is served here as usual."""
+
+    def __init__(self, worker_ports):
+        super().__init__()
+        self.worker_ports = worker_ports
+
+    def http_game(self, object_address, headers, keep_alive=False, body=b''):
+        # 307 makes the client repeat the same method and body against the worker.
+        room_id, _ = self.game_route(object_address)
+        worker_port = self.worker_ports[worker_for_room(room_id, len(self.worker_ports))]
+        host = (header_value(headers, 'host') or '127.0.0.1').rsplit(':', 1)[0]
+        location = f"http://{host}:{worker_port}{object_address}"
+        return self.response(307, 'Temporary Redirect', '', {'Location': location}, keep_alive)
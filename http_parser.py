@@ -0,0 +1,133 @@
+"""Incremental HTTP/1.x request parser for the game servers.
+
+Bytes are appended to one bytearray as they arrive. Only the new part is scanned for the
+end of the header block, consumed requests are cut off the front, and bodies are
+delimited by Content-Length. One feed may therefore complete several pipelined requests,
+and a read that splits a request (even inside a UTF-8 sequence) just waits for the rest.
+"""
+
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+_HEAD_END = b'\r\n\r\n'
+
+
+class HttpParseError(Exception):
+    """A request the server cannot read; answer with status/reason and close."""
+
+    def __init__(self, status, reason):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+
+class HttpRequest:
+    def __init__(self, method, path, version, headers, head):
+        self.method = method
+        self.path = path
+        self.version = version
+        # Raw "Name: value" lines, the form HttpServer's handlers have always received.
+        self.headers = headers
+        self.head = head
+        self.body = b''
+        self.keep_alive = is_keep_alive(version, headers)
+
+    def header(self, name, default=None):
+        return header_value(self.headers, name, default)
+
+
+def header_value(headers, name, default=None):
+    """Value of the first raw "Name: value" line called name (case-insensitive)."""
+    name = name.lower()
+    for line in headers:
+        key, _, value = line.partition(':')
+        if key.strip().lower() == name:
+            return value.strip()
+    return default
+
+
+def is_keep_alive(version, headers):
+    """HTTP/1.1 keeps the connection open unless the client asks to close it;
+    HTTP/1.0 only does so when the client explicitly asks for keep-alive."""
+    connection = ""
+    for header in headers:
+        name, _, value = header.partition(':')
+        if name.strip().lower() == 'connection':
+            connection = value.strip().lower()
+    if version.upper() == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+
+class RequestParser:
+    def __init__(self, max_header_size=MAX_HEADER_SIZE, max_body_size=MAX_BODY_SIZE):
+        self.buffer = bytearray()
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        # Where the next search for the end of the header block starts.
+        self._scan_from = 0
+        # A request whose header block is parsed but whose body is still arriving.
+        self._pending, self._body_length = None, 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def __iter__(self):
+        """Yields every request completed by the bytes fed so far, in order."""
+        while True:
+            request = self.next_request()
+            if request is None:
+                return
+            yield request
+
+    def next_request(self):
+        """Returns the next complete HttpRequest, or None until more bytes arrive."""
+        if self._pending is None and not self._parse_head():
+            return None
+
+        if len(self.buffer) < self._body_length:
+            return None
+        request = self._pending
+        if self._body_length:
+            request.body = bytes(self.buffer[:self._body_length])
+            del self.buffer[:self._body_length]
+        self._pending, self._body_length = None, 0
+        return request
+
+    def _parse_head(self):
+        head_end = self.buffer.find(_HEAD_END, self._scan_from)
+        if head_end == -1:
+            if len(self.buffer) > self.max_header_size:
+                raise HttpParseError(431, 'Request Header Fields Too Large')
+            # The terminator may straddle this read and the next one.
+            self._scan_from = max(0, len(self.buffer) - len(_HEAD_END) + 1)
+            return False
+        if head_end > self.max_header_size:
+            raise HttpParseError(431, 'Request Header Fields Too Large')
+
+        with memoryview(self.buffer) as view:
+            head = str(view[:head_end], 'utf-8', 'replace')
+        del self.buffer[:head_end + len(_HEAD_END)]
+        self._scan_from = 0
+
+        lines = head.split('\r\n')
+        request_line = lines[0].split(' ')
+        if len(request_line) < 2 or not request_line[0]:
+            raise HttpParseError(400, 'Bad Request')
+        version = request_line[2].strip() if len(request_line) > 2 else 'HTTP/1.0'
+        request = HttpRequest(request_line[0].upper().strip(), request_line[1].strip(), version,
+                              [line for line in lines[1:] if line], head)
+
+        if request.header('transfer-encoding') is not None:
+            raise HttpParseError(501, 'Not Implemented')
+        try:
+            body_length = int(request.header('content-length', 0))
+        except ValueError:
+            raise HttpParseError(400, 'Bad Request')
+        if body_length < 0:
+            raise HttpParseError(400, 'Bad Request')
+        if body_length > self.max_body_size:
+            raise HttpParseError(413, 'Payload Too Large')
+
+        self._pending, self._body_length = request, body_length
+        return True
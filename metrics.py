@@ -0,0 +1,186 @@
+"""Always-on server metrics, served by HttpServer at /metrics in Prometheus text format.
+
+Recording never takes a lock: every thread updates its own shard of each metric, and a
+scrape sums the shards. Shards of threads that have exited are folded into one retired
+total, so connection threads coming and going do not grow the shard list.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from scheduler import scheduler
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+REGISTRY = []
+
+
+class _ShardedMetric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                # Pruned here as well as on scrapes, so the list (and the dead threads it
+                # references) stays bounded by the live threads even if nobody scrapes.
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def _series(self, labels):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = self._new_series()
+        return series
+
+    def collect(self):
+        """{labels: summed series} over every thread that ever recorded a value."""
+        with self._shards_lock:
+            self._retire_dead()
+            totals = {}
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        return totals
+
+    def _merge(self, into, shard):
+        for labels, series in list(shard.items()):
+            total = into.get(labels)
+            if total is None:
+                total = into[labels] = self._new_series()
+            for i, value in enumerate(series):
+                total[i] += value
+
+    def _label_text(self, labels, extra=()):
+        pairs = [*zip(self.labelnames, labels), *extra]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return [0]
+
+    def inc(self, *labels, amount=1):
+        self._series(labels)[0] += amount
+
+    def total(self):
+        return sum(series[0] for series in self.collect().values())
+
+    def render(self):
+        return [f"{self.name}{self._label_text(labels)} {series[0]}"
+                for labels, series in sorted(self.collect().items())]
+
+
+class Histogram(_ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+
+    def _new_series(self):
+        # One count per bucket plus +Inf, then the sum of all observed values.
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *labels):
+        series = self._series(labels)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = []
+        for labels, series in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {cumulative}")
+        return lines
+
+
+class TimedLock:
+    """threading.Lock that records how long callers wait for it and how long it is held."""
+
+    def __init__(self, wait=None, hold=None):
+        self._lock = threading.Lock()
+        self._wait = wait or LOCK_WAIT
+        self._hold = hold or LOCK_HOLD
+        # Only written by the current holder.
+        self._acquired_at = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        self._acquired_at = now = time.perf_counter()
+        self._wait.observe(now - start)
+        return self
+
+    def __exit__(self, *exc_info):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self._hold.observe(held)
+
+
+COMMAND_DURATION = Histogram('game_command_duration_seconds',
+                             "Time to run and encode one game command, including waiting for the room lock",
+                             ('command',))
+LOCK_WAIT = Histogram('game_lock_wait_seconds', "Time spent waiting for a room's PlayerServerProtocol lock")
+LOCK_HOLD = Histogram('game_lock_hold_seconds', "Time a room's PlayerServerProtocol lock was held")
+RESPONSE_BYTES = Histogram('http_response_bytes', "Size of HTTP responses, headers included", buckets=SIZE_BUCKETS)
+CONNECTIONS_OPENED = Counter('http_connections_opened_total', "Client connections accepted")
+CONNECTIONS_CLOSED = Counter('http_connections_closed_total', "Client connections closed")
+
+
+def render(gauges=None):
+    """The exposition text. gauges maps extra metric names to (help text, current value)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+
+    current = {
+        'http_connections_active': ("Client connections currently open",
+                                    CONNECTIONS_OPENED.total() - CONNECTIONS_CLOSED.total()),
+        'process_threads': ("Threads alive in this server process", threading.active_count()),
+        'game_scheduled_events_pending': ("Delayed game events waiting in the scheduler", scheduler.pending),
+        **(gauges or {}),
+    }
+    for name, (help_text, value) in current.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
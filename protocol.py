@@ -1,15 +1,56 @@
 import json
 import base64
-import threading
 import io
 import logging
 import time
+from functools import lru_cache
 from PIL import Image, ImageDraw
 
+from scheduler import scheduler
+from metrics import TimedLock
+import wire_format
+
+# Every command proses understands; HttpServer uses it to tell room ids from commands in URLs.
+COMMANDS = frozenset({
+    "batch", "register_player", "set_player_state", "get_game_state", "get_level", "get_dynamic_state",
+    "get_state_since", "collect_gem", "check_hazard_collision", "player_at_exit", "player_input",
+    "get_server_info", "reset_game",
+})
+
+# Delays of the events handed to the shared scheduler.
+RESPAWN_DELAY = 1.0
+NEXT_STAGE_DELAY = 3.0
+
+# Read-only commands, answered from the latest StateSnapshot without taking the lock.
+# Their encoded responses are shared between requests (see proses_encoded): an entry is
+# reused for as long as its snapshot is the latest; ones carrying the game clock only for
+# RESPONSE_CACHE_MAX_AGE, so elapsed_time stays current. That is a few polls of a 60 Hz
+# client, and well within the whole seconds the client shows. Reads inside a batch are
+# never cached.
+READ_COMMANDS = frozenset({"get_game_state", "get_level", "get_dynamic_state", "get_state_since"})
+UNTIMED_COMMANDS = frozenset({"get_level"})
+RESPONSE_CACHE_SIZE = 64
+RESPONSE_CACHE_MAX_AGE = 0.1
+
+# Upper bound on sub-commands in one batch, so a single request cannot hold the lock for long.
+MAX_BATCH_COMMANDS = 32
+
+# Physics mirrored from PlayerCharacter.move in client.py, used by the server-authoritative
+# simulation. The constants are per step of a PHYSICS_HZ loop, like the client's 60 FPS frame.
+PHYSICS_HZ = 60
+PLAYER_SIZE = 48
+GEM_SIZE = 20
+PLAYER_SPEED = 5
+GRAVITY = 0.5
+JUMP_STRENGTH = -10
+TERMINAL_VELOCITY = 10
+INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP = 1, 2, 4
+
 # Set logging level for the server protocol
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+@lru_cache(maxsize=None)
 def generate_simple_image_b64(width, height, color, shape="square", border_color=None, border_width=0, alpha=255):
     img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
     d = ImageDraw.Draw(img)
@@ -48,9 +89,127 @@ def generate_simple_image_b64(width, height, color, shape="square", border_color
     return base64.b64encode(buffered.getvalue()).decode('utf-8')
 
 
+def run_at_fixed_rate(rate, callback):
+    """Calls callback rate times per second forever; when it falls behind it skips ahead
+    instead of bursting to catch up."""
+    interval = 1.0 / rate
+    next_tick = time.monotonic()
+    while True:
+        callback()
+        next_tick += interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_tick = time.monotonic()
+
+
+class StateSnapshot:
+    """What readers see of a match, as of one moment. PlayerServerProtocol publishes a new
+    one under its lock after every change; nothing in it is modified afterwards, so any
+    number of threads can read it without locking. Entity dicts are copied at publish time
+    (gem dicts are never modified by the protocol, so they are shared) and results built
+    from a snapshot share them: callers must not modify results.
+
+    responses memoizes encoded responses (see proses_encoded); level_responses is handed
+    on to the next snapshot for as long as the stage stays the same."""
+
+    def __init__(self, protocol, stamp, previous=None):
+        self.stamp = stamp
+        self.level_version, self.state_version = protocol.level_version, protocol.state_version
+        self.tick, self.tick_time, self.tick_rate = protocol.tick, protocol._tick_time, protocol.tick_rate
+        self.start_time = protocol.start_time
+        # Simulated positions only change on ticks; client-driven ones when a client reports,
+        # which is when a new snapshot is built. Rereading an unchanged snapshot repeats its
+        # time, so clients never see a still player at later and later times, then a jump.
+        self.published_at = self.tick_time if self.tick_rate else time.monotonic()
+        self.history_start = protocol._history_start
+        self.changed_players, self.changed_gems = dict(protocol._changed_players), dict(protocol._changed_gems)
+        self.players = {p_id: dict(p_data) for p_id, p_data in protocol.players.items()}
+        self.gems = dict(protocol.gems)
+        self.gem_list = [{'id': g_id, **g_data} for g_id, g_data in self.gems.items()]
+        self.game_info = {
+            "current_stage": protocol.current_level_index + 1,
+            "total_stages": protocol.total_stages,
+            "scores": dict(protocol.scores),
+            "stage_winner": protocol.stage_winner,
+            "match_winner": protocol.match_winner,
+            "required_gems": {
+                'black': protocol.black_gems_required,
+                'white': protocol.white_gems_required
+            }
+        }
+        if previous is not None and previous.level_version == self.level_version:
+            self.level, self.level_responses = previous.level, previous.level_responses
+        else:
+            self.level, self.level_responses = protocol._get_level(), {}
+        self.responses = {}
+
+    def read(self, command, args):
+        """Result of one of READ_COMMANDS."""
+        if command == "get_game_state": return self.game_state()
+        if command == "get_level": return self.level
+        if command == "get_dynamic_state": return self.dynamic_state()
+        try: return self.state_since(int(args[0]))
+        except (ValueError, IndexError): return {"status": "ERROR"}
+
+    def server_time(self):
+        return self.published_at
+
+    def get_game_info(self):
+        elapsed_time = (time.time() - self.start_time) if self.start_time else 0
+        return {**self.game_info, "elapsed_time": elapsed_time}
+
+    def dynamic_state(self):
+        # Per-frame data; clients refetch get_level when level_version changes.
+        return {
+            "status": "OK",
+            "level_version": self.level_version,
+            "state_version": self.state_version,
+            "tick": self.tick,
+            "server_time": self.server_time(),
+            "players": self.players,
+            "gems": self.gem_list,
+            "game_info": self.get_game_info()
+        }
+
+    def state_since(self, since_version):
+        # Clients older than the last level load (or ahead of a restarted server) resync fully.
+        if since_version < self.history_start or since_version > self.state_version:
+            return {**self.dynamic_state(), "full": True}
+
+        changed_gems = [g_id for g_id, version in self.changed_gems.items() if version > since_version]
+        return {
+            "status": "OK",
+            "full": False,
+            "level_version": self.level_version,
+            "state_version": self.state_version,
+            "tick": self.tick,
+            "server_time": self.server_time(),
+            "players": {p_id: self.players[p_id] for p_id, version in self.changed_players.items()
+                        if version > since_version and p_id in self.players},
+            "gems": [{'id': g_id, **self.gems[g_id]} for g_id in changed_gems if g_id in self.gems],
+            "removed_gems": [g_id for g_id in changed_gems if g_id not in self.gems],
+            "game_info": self.get_game_info()
+        }
+
+    def game_state(self):
+        level = self.level
+        return {
+            "status": "OK",
+            "players": self.players,
+            "gems": self.gem_list,
+            "hazards": level['hazards'],
+            "walls": level['walls'],
+            "exit_area": level['exit_area'],
+            "images": level['images'],
+            "game_info": self.get_game_info()
+        }
+
+
 class PlayerServerProtocol:
     def __init__(self):
-        self._lock = threading.Lock()
+        self._lock = TimedLock()
         self.map_width = 800
         self.map_height = 600
         self.default_player_lives = 3
@@ -61,6 +220,27 @@ class PlayerServerProtocol:
         self.current_level_index, self.match_winner, self.stage_winner, self.start_time, self._next_gem_id = 0, None, None, None, 0
         self.black_gems_required = 0
         self.white_gems_required = 0
+        self.level_version = 0
+        # Every mutation bumps state_version; entities remember the version they last
+        # changed at so get_state_since can send only what a client has not seen yet.
+        self.state_version = 0
+        self._history_start = 0
+        self._changed_players, self._changed_gems = {}, {}
+        # Server-authoritative mode: tick_rate is None until RoomManager.start_simulation sets it
+        # and starts calling simulation_tick.
+        self.tick_rate = None
+        self._bodies, self._physics_accumulator = {}, 0.0
+        # Snapshots are stamped with the simulation tick and a server clock reading, so
+        # clients can place them on one timeline and interpolate remote players.
+        self.tick, self._tick_time = 0, time.monotonic()
+        # Per-stage (id, type, left, top, right, bottom) rects for server-side event detection.
+        self._gem_rects, self._hazard_rects, self._exit_rect = {}, [], None
+        # Respawns and stage changes still to come; reset_game cancels them and bumps
+        # _reset_count so one the scheduler already picked up is ignored too.
+        self.scheduler = scheduler
+        self._scheduled, self._reset_count = [], 0
+        # The latest StateSnapshot; replaced (never modified) by _publish.
+        self.snapshot = None
         
         self.black_gem_image_b64 = generate_simple_image_b64(20, 20, (50, 50, 50, 255), "diamond", border_color=(255, 255, 255), border_width=2)
         self.white_gem_image_b64 = generate_simple_image_b64(20, 20, (255, 255, 255, 255), "diamond", border_color=(0, 0, 0), border_width=2)
@@ -72,6 +252,7 @@ class PlayerServerProtocol:
         self.wall_image_b64 = generate_simple_image_b64(20, 20, (100, 100, 100), "brick", (50, 50, 50), 1)
 
         self._full_reset()
+        self._publish()
 
     def _define_levels(self):
         self.levels = []
@@ -117,9 +298,13 @@ class PlayerServerProtocol:
             return
         level_data = self.levels[level_index]
         self.current_level_index = level_index
-        self.gems.clear(); self.hazards.clear(); self.walls.clear()
+        self.level_version += 1
+        self.gems.clear(); self.hazards.clear(); self.walls.clear(); self._gem_rects.clear()
         self.black_gems_required = 0; self.white_gems_required = 0
         self._next_gem_id = 0; self.stage_winner = None
+        self._changed_players.clear(); self._changed_gems.clear()
+        self._mark_changed()
+        self._history_start = self.state_version
         self._place_wall(0, self.map_height - 20, self.map_width, 20)
         self._place_wall(0, 0, 20, self.map_height)
         self._place_wall(self.map_width - 20, 0, 20, self.map_height)
@@ -131,6 +316,9 @@ class PlayerServerProtocol:
         for gem in level_data.get('gems', []): self._place_gem(gem[1], gem[2], gem[0])
         exit_data = level_data.get('exit')
         self.exit_area = {'x': exit_data[0], 'y': exit_data[1], 'width': exit_data[2], 'height': exit_data[3]}
+        self._hazard_rects = [(h_id, h['type'], h['x'], h['y'], h['x'] + h['width'], h['y'] + h['height'])
+                              for h_id, h in self.hazards.items()]
+        self._exit_rect = (exit_data[0], exit_data[1], exit_data[0] + exit_data[2], exit_data[1] + exit_data[3])
         for pid, player in self.players.items():
             self._reset_player_for_new_stage(player, level_data.get('start_pos'))
         logging.info(f"Server: Level {level_index + 1} loaded.")
@@ -146,20 +334,46 @@ class PlayerServerProtocol:
         player_data['gems_collected'] = 0
         player_data['at_exit'] = False
         player_data['is_dead'] = False
+        self._reset_body(player_data['color_type'])
 
     def _respawn_player(self, player_id):
+        if player_id in self.players:
+            player = self.players[player_id]
+            level_data = self.levels[self.current_level_index]
+            start_pos = level_data.get('start_pos', {})
+            
+            if player['color_type'] in start_pos:
+                player['x'], player['y'] = start_pos[player['color_type']]
+            self._reset_body(player['color_type'])
+            
+            player['is_dead'] = False 
+            self._mark_changed(player_id=player_id)
+            
+            logging.info(f"Player {player_id} respawned at {player['x']}, {player['y']}")
+
+    def _schedule(self, delay, callback, *args):
+        """Runs callback(*args) under the lock after delay seconds, unless the game is reset first."""
+        self._scheduled = [event for event in self._scheduled if event.active]
+        self._scheduled.append(self.scheduler.call_later(delay, self._run_scheduled, self._reset_count, callback, args))
+
+    def _run_scheduled(self, reset_count, callback, args):
         with self._lock:
-            if player_id in self.players:
-                player = self.players[player_id]
-                level_data = self.levels[self.current_level_index]
-                start_pos = level_data.get('start_pos', {})
-                
-                if player['color_type'] in start_pos:
-                    player['x'], player['y'] = start_pos[player['color_type']]
-                
-                player['is_dead'] = False 
-                
-                logging.info(f"Player {player_id} respawned at {player['x']}, {player['y']}")
+            if reset_count == self._reset_count:
+                callback(*args)
+                self._publish()
+
+    def _cancel_scheduled(self):
+        for event in self._scheduled: self.scheduler.cancel(event)
+        self._scheduled = []
+        self._reset_count += 1
+
+    def cancel_scheduled(self):
+        """Drops this match's pending events, e.g. when its room is reclaimed."""
+        with self._lock:
+            self._cancel_scheduled()
+
+    def pending_events(self):
+        return sum(1 for event in self._scheduled if event.active)
 
     def _load_next_stage(self):
         if self.match_winner: return
@@ -169,47 +383,183 @@ class PlayerServerProtocol:
     def _determine_final_winner(self):
         if self.scores['player_black'] > self.scores['player_white']: self.match_winner = 'player_black'
         elif self.scores['player_white'] > self.scores['player_black']: self.match_winner = 'player_white'
+        self._mark_changed()
         logging.warning(f"MATCH OVER! Final Winner: {self.match_winner}")
 
     def _full_reset(self):
+        self._cancel_scheduled()
         self.players.clear()
+        self._bodies.clear()
         self.scores = {'player_black': 0, 'player_white': 0}
         self.match_winner = None; self.stage_winner = None; self.start_time = None
         self._define_levels()
         self._load_level(0)
         logging.warning("SERVER: Full game has been reset to initial state.")
 
+    def _mark_changed(self, player_id=None, gem_id=None):
+        self.state_version += 1
+        if player_id: self._changed_players[player_id] = self.state_version
+        if gem_id: self._changed_gems[gem_id] = self.state_version
+
     def _place_wall(self, x, y, width, height):
         wall_id = f"wall_{len(self.walls)}"; self.walls[wall_id] = {'x': x, 'y': y, 'width': width, 'height': height}
 
     def _place_gem(self, x, y, gem_type):
         gem_id = f"{gem_type}_gem_{self._next_gem_id}"; self._next_gem_id += 1
         self.gems[gem_id] = {'x': x, 'y': y, 'type': gem_type}
+        self._gem_rects[gem_id] = (gem_type, x, y, x + GEM_SIZE, y + GEM_SIZE)
         if gem_type == 'black':
             self.black_gems_required += 1
         elif gem_type == 'white':
             self.white_gems_required += 1
         return gem_id
 
+    def _publish(self):
+        """Replaces the snapshot if anything it shows has changed. Call with the lock held."""
+        stamp = (self.level_version, self.state_version, self.tick, self.start_time, self.tick_rate)
+        if self.snapshot is None or self.snapshot.stamp != stamp:
+            self.snapshot = StateSnapshot(self, stamp, self.snapshot)
+
     def proses_string(self, command_string):
+        return json.dumps(self.proses(command_string))
+
+    def proses(self, command_string):
+        parts = command_string.split(None, 2)
+        if parts and parts[0].lower() in READ_COMMANDS:
+            # Readers never wait for writers (or each other): they use whichever snapshot is latest.
+            return self.snapshot.read(parts[0].lower(), parts[1:])
+        with self._lock:
+            result = self._proses(command_string)
+            self._publish()
+            return result
+
+    def _proses(self, command_string):
         parts = command_string.strip().split()
         command, args = parts[0].lower(), parts[1:]
+        if not self.start_time and len(self.players) >= 1: self.start_time = time.time()
+        if command == "batch":
+            return self._run_batch(command_string.strip()[len(parts[0]):])
+        return self._dispatch(command, args)
+
+    def proses_encoded(self, command_string, binary=False):
+        """proses for the HTTP layer, returning (content type, body bytes). Concurrent reads
+        of an unchanged state get the same pre-serialized buffer instead of each
+        rebuilding and re-encoding it; the first read of a new snapshot encodes it again.
+        Reads take no lock at all; racing readers may encode the same snapshot twice."""
+        parts = command_string.split(None, 2)
+        command = parts[0].lower() if parts else ''
+        if command not in READ_COMMANDS:
+            return wire_format.encode_response(self.proses(command_string), binary)
+
+        snapshot = self.snapshot
+        cache = snapshot.level_responses if command in UNTIMED_COMMANDS else snapshot.responses
+        key = (command_string.strip(), binary)
+        now = time.monotonic()
+        entry = cache.get(key)
+        if entry and (command in UNTIMED_COMMANDS or now - entry[0] < RESPONSE_CACHE_MAX_AGE):
+            return entry[1]
+        encoded = wire_format.encode_response(snapshot.read(command, parts[1:]), binary)
+        if len(cache) >= RESPONSE_CACHE_SIZE:
+            cache.clear()
+        cache[key] = (now, encoded)
+        return encoded
+
+    def _run_batch(self, batch_string):
+        # Sub-commands are separated by ';' and run in order under the single lock held by proses.
+        sub_commands = [sub.split() for sub in batch_string.split(';') if sub.strip()]
+        if len(sub_commands) > MAX_BATCH_COMMANDS:
+            return {"status": "ERROR", "message": f"Batch is limited to {MAX_BATCH_COMMANDS} commands."}
+        results = []
+        for sub_parts in sub_commands:
+            sub_command = sub_parts[0].lower()
+            if sub_command == "batch": results.append({"status": "ERROR", "message": "Nested batch."})
+            else: results.append(self._dispatch(sub_command, sub_parts[1:]))
+        return {"status": "OK", "results": results}
+
+    def _dispatch(self, command, args):
         result = {"status": "ERROR", "message": "Unknown command"}
+        if command == "register_player":
+            result = self._register_player(args[0]) if args else {"status": "ERROR"}
+        elif command == "set_player_state":
+            # A fourth argument (the lives older clients still send) is accepted and ignored.
+            if len(args) in (3, 4):
+                try: result = self._set_player_state(args[0], int(args[1]), int(args[2]))
+                except (ValueError, IndexError): result = {"status": "ERROR"}
+            else: result = {"status": "ERROR"}
+        elif command in READ_COMMANDS:
+            # Inside a batch: publish what earlier sub-commands changed, then read it back.
+            self._publish()
+            result = self.snapshot.read(command, args)
+        elif command == "collect_gem": result = self._collect_gem(args[0], args[1]) if len(args) == 2 else {"status": "ERROR"}
+        elif command == "check_hazard_collision": result = self._check_hazard_collision(args[0], args[1]) if len(args) == 2 else {"status": "ERROR"}
+        elif command == "player_at_exit": result = self._player_at_exit(args[0]) if args else {"status": "ERROR"}
+        elif command == "player_input":
+            try: result = self._player_input(args[0], int(args[1]))
+            except (ValueError, IndexError): result = {"status": "ERROR"}
+        elif command == "get_server_info":
+            result = {"status": "OK", "simulation_hz": self.tick_rate or 0,
+                      "pending_events": self.pending_events(), "scheduler_pending_events": self.scheduler.pending}
+        elif command == "reset_game": self._full_reset(); result = {"status": "OK"}
+        return result
+
+    def simulation_tick(self):
         with self._lock:
-            if not self.start_time and len(self.players) >= 1: self.start_time = time.time()
-            if command == "register_player":
-                result = self._register_player(args[0]) if args else {"status": "ERROR"}
-            elif command == "set_player_state":
-                if len(args) == 4:
-                    try: result = self._set_player_state(args[0], int(args[1]), int(args[2]), int(args[3]))
-                    except (ValueError, IndexError): result = {"status": "ERROR"}
-                else: result = {"status": "ERROR"}
-            elif command == "get_game_state": result = self._get_game_state()
-            elif command == "collect_gem": result = self._collect_gem(args[0], args[1]) if len(args) == 2 else {"status": "ERROR"}
-            elif command == "check_hazard_collision": result = self._check_hazard_collision(args[0], args[1]) if len(args) == 2 else {"status": "ERROR"}
-            elif command == "player_at_exit": result = self._player_at_exit(args[0]) if args else {"status": "ERROR"}
-            elif command == "reset_game": self._full_reset(); result = {"status": "OK"}
-        return json.dumps(result)
+            self._simulation_tick()
+            self._publish()
+
+    def _simulation_tick(self):
+        # Run as many fixed PHYSICS_HZ steps as this tick covers, so the tick rate only
+        # changes how often positions are published, not how fast players move.
+        self._physics_accumulator += PHYSICS_HZ / self.tick_rate
+        steps = int(self._physics_accumulator)
+        self._physics_accumulator -= steps
+        self.tick, self._tick_time = self.tick + 1, time.monotonic()
+        if self.match_winner or self.stage_winner: return
+        for player_id, player in self.players.items():
+            x, y = player['x'], player['y']
+            for _ in range(steps): self._step_player(player, self._bodies[player['color_type']])
+            if (player['x'], player['y']) != (x, y): self._mark_changed(player_id=player_id)
+            self._detect_events(player_id)
+
+    def _step_player(self, player, body):
+        if player.get('is_dead', False): return
+        buttons = body['input']
+        dx = 0
+        if buttons & INPUT_LEFT: dx = -PLAYER_SPEED
+        if buttons & INPUT_RIGHT: dx = PLAYER_SPEED
+
+        body['vy'] = min(body['vy'] + GRAVITY, TERMINAL_VELOCITY)
+        if body['on_ground'] and buttons & INPUT_JUMP:
+            body['vy'], body['on_ground'] = JUMP_STRENGTH, False
+
+        x = player['x'] + dx
+        for wall in self.walls.values():
+            if self._overlaps_wall(x, player['y'], wall):
+                if dx > 0: x = wall['x'] - PLAYER_SIZE
+                elif dx < 0: x = wall['x'] + wall['width']
+
+        y = int(player['y'] + body['vy'])
+        body['on_ground'] = False
+        for wall in self.walls.values():
+            if self._overlaps_wall(x, y, wall):
+                if body['vy'] > 0: y, body['vy'], body['on_ground'] = wall['y'] - PLAYER_SIZE, 0, True
+                elif body['vy'] < 0: y, body['vy'] = wall['y'] + wall['height'], 0
+        player['x'], player['y'] = x, y
+
+    def _overlaps_wall(self, x, y, wall):
+        return (x < wall['x'] + wall['width'] and wall['x'] < x + PLAYER_SIZE and
+                y < wall['y'] + wall['height'] and wall['y'] < y + PLAYER_SIZE)
+
+    def _reset_body(self, color):
+        # Held buttons survive respawns and stage changes; only the motion state is cleared.
+        body = self._bodies.setdefault(color, {'input': 0})
+        body['vy'], body['on_ground'] = 0, False
+
+    def _player_input(self, player_id, buttons):
+        if player_id not in self.players: return {"status": "ERROR", "message": "Player not found."}
+        if not self.tick_rate: return {"status": "ERROR", "message": "Server simulation is not running."}
+        self._bodies[self.players[player_id]['color_type']]['input'] = buttons
+        return {"status": "OK"}
 
     def _register_player(self, color_choice):
         color_choice = color_choice.lower()
@@ -219,35 +569,60 @@ class PlayerServerProtocol:
         player_data = {'color_type': color_choice}
         self.players[player_id] = player_data
         self._reset_player_for_new_stage(player_data, self.levels[self.current_level_index].get('start_pos'))
+        self._mark_changed(player_id=player_id)
         if len(self.players) == 1 and not self.start_time: self.start_time = time.time()
         logging.info(f"Player {player_id} registered.")
         return {"status": "OK", "player_id": player_id, "color_type": color_choice, "x": player_data['x'], "y": player_data['y']}
 
-    def _set_player_state(self, player_id, x, y, lives):
+    def _set_player_state(self, player_id, x, y):
+        # Only the position comes from the client: lives are the server's since it detects
+        # hazard hits, and a report queued before the client saw a hit would undo it.
+        if self.tick_rate: return {"status": "ERROR", "message": "Positions are simulated by the server."}
+        if not (0 <= x <= self.map_width and 0 <= y <= self.map_height):
+            return {"status": "ERROR", "message": "Player state out of range."}
         if player_id in self.players:
-            self.players[player_id].update({'x': x, 'y': y, 'lives': lives}); return {"status": "OK"}
+            player = self.players[player_id]
+            if (player['x'], player['y']) != (x, y):
+                player.update({'x': x, 'y': y})
+                self._mark_changed(player_id=player_id)
+            return {"status": "OK", "events": self._detect_events(player_id)}
         return {"status": "ERROR", "message": "Player not found."}
 
-    def _get_game_state(self):
-        elapsed_time = (time.time() - self.start_time) if self.start_time else 0
-        
-        game_info_data = {
-            "current_stage": self.current_level_index + 1,
-            "total_stages": self.total_stages,
-            "scores": self.scores,
-            "elapsed_time": elapsed_time,
-            "stage_winner": self.stage_winner,
-            "match_winner": self.match_winner,
-            "required_gems": {
-                'black': self.black_gems_required,
-                'white': self.white_gems_required
-            }
-        }
-        
+    def _detect_events(self, player_id):
+        """Applies gem pickups, hazard hits and exit arrival for the player's current
+        position, the way the client used to request them, and reports what happened."""
+        events = []
+        player = self.players[player_id]
+        if self.match_winner or self.stage_winner or player['lives'] <= 0: return events
+        left, top = player['x'], player['y']
+        right, bottom = left + PLAYER_SIZE, top + PLAYER_SIZE
+        color = player['color_type']
+
+        for g_id, (g_type, g_left, g_top, g_right, g_bottom) in list(self._gem_rects.items()):
+            if g_type == color and left < g_right and g_left < right and top < g_bottom and g_top < bottom:
+                if self._collect_gem(player_id, g_id)['status'] == 'OK':
+                    events.append({'event': 'gem_collected', 'gem_id': g_id})
+
+        if not player.get('is_dead', False):
+            for h_id, h_type, h_left, h_top, h_right, h_bottom in self._hazard_rects:
+                if h_type != color and left < h_right and h_left < right and top < h_bottom and h_top < bottom:
+                    if self._check_hazard_collision(player_id, h_id)['status'] == 'OK':
+                        events.append({'event': 'hazard_hit', 'hazard_id': h_id})
+                    break
+
+        if self._exit_rect and not player['at_exit'] and not self.stage_winner:
+            e_left, e_top, e_right, e_bottom = self._exit_rect
+            if left < e_right and e_left < right and top < e_bottom and e_top < bottom:
+                self._player_at_exit(player_id)
+                if self.stage_winner == player_id: events.append({'event': 'stage_won'})
+        return events
+
+    def _get_level(self):
+        # Static stage data: only changes when a level is loaded, tracked by level_version.
         return {
             "status": "OK",
-            "players": {p_id: {**p_data} for p_id, p_data in self.players.items()},
-            "gems": [{'id': g_id, **g_data} for g_id, g_data in self.gems.items()],
+            "level_version": self.level_version,
+            "current_stage": self.current_level_index + 1,
             "hazards": [{'id': h_id, **h_data} for h_id, h_data in self.hazards.items()],
             "walls": [{'id': w_id, **w_data} for w_id, w_data in self.walls.items()],
             "exit_area": self.exit_area,
@@ -255,18 +630,18 @@ class PlayerServerProtocol:
                 "black_gem": self.black_gem_image_b64, "white_gem": self.white_gem_image_b64,
                 "black_hazard": self.black_hazard_image_b64, "white_hazard": self.white_hazard_image_b64,
                 "exit": self.exit_area_image_b64, "wall": self.wall_image_b64
-            },
-            "game_info": game_info_data
+            }
         }
 
     def _handle_stage_win(self, winner_id):
         if self.stage_winner: return
         self.stage_winner = winner_id
         self.scores[winner_id] += 1
+        self._mark_changed()
         logging.warning(f"STAGE {self.current_level_index+1} WON by {winner_id}! Score: {self.scores}")
         if self.scores[winner_id] >= (self.total_stages//2+1): self._determine_final_winner()
         elif self.current_level_index+1 >= self.total_stages: self._determine_final_winner()
-        else: threading.Timer(3.0, self._load_next_stage).start()
+        else: self._schedule(NEXT_STAGE_DELAY, self._load_next_stage)
 
     def _collect_gem(self, player_id, gem_id):
         if self.match_winner or self.stage_winner: return {"status":"ERROR"}
@@ -274,7 +649,10 @@ class PlayerServerProtocol:
             player, gem = self.players[player_id], self.gems[gem_id]
             if player['color_type'] == gem['type']:
                 player['gems_collected'] += 1
-                del self.gems[gem_id]; return {"status":"OK"}
+                del self.gems[gem_id]
+                del self._gem_rects[gem_id]
+                self._mark_changed(player_id=player_id, gem_id=gem_id)
+                return {"status":"OK"}
         return {"status":"ERROR"}
 
     def _check_hazard_collision(self, player_id, hazard_id):
@@ -288,13 +666,14 @@ class PlayerServerProtocol:
                 
                 player['is_dead'] = True
                 player['lives'] -= 1
+                self._mark_changed(player_id=player_id)
                 logging.info(f"Player {player_id} hit a hazard. Lives remaining: {player['lives']}")
                 
                 if player['lives'] <= 0:
                     opponent_id = 'player_white' if player['color_type'] == 'black' else 'player_black'
                     self._handle_stage_win(opponent_id)
                 else:
-                    threading.Timer(1.0, self._respawn_player, args=[player_id]).start()
+                    self._schedule(RESPAWN_DELAY, self._respawn_player, player_id)
                     
                 return {"status": "OK"}
         
@@ -310,6 +689,7 @@ class PlayerServerProtocol:
             
             if player['gems_collected'] >= required_gems:
                 player['at_exit'] = True
+                self._mark_changed(player_id=player_id)
                 self._handle_stage_win(player_id)
                 return {"status": "OK", "message": "Player at exit processed."}
             else:
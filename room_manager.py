@@ -0,0 +1,93 @@
+import re
+import threading
+import zlib
+import logging
+import time
+
+from protocol import PlayerServerProtocol, run_at_fixed_rate
+
+DEFAULT_ROOM = 'default'
+MAX_ROOMS = 10000
+# Rooms nobody has sent a command to for this long are reclaimed; finished matches sooner.
+ROOM_IDLE_TIMEOUT = 300
+FINISHED_ROOM_TIMEOUT = 60
+SWEEP_INTERVAL = 10
+
+ROOM_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+def worker_for_room(room_id, workers):
+    """Deterministic room -> worker index, stable across processes and restarts."""
+    return zlib.crc32(room_id.encode('utf-8')) % workers
+
+
+class Room:
+    def __init__(self, room_id, protocol):
+        self.room_id = room_id
+        self.protocol = protocol
+        self.last_active = time.monotonic()
+
+
+class RoomManager:
+    """Keeps one independent PlayerServerProtocol (and so one lock) per match, keyed by room id.
+
+    Rooms are created on first use and reclaimed by a sweep that piggybacks on lookups,
+    once they have been idle for ROOM_IDLE_TIMEOUT or their match has been over for
+    FINISHED_ROOM_TIMEOUT. The default room is never reclaimed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rooms = {DEFAULT_ROOM: Room(DEFAULT_ROOM, PlayerServerProtocol())}
+        self.tick_rate = None
+        self._last_sweep = time.monotonic()
+
+    @property
+    def default(self):
+        return self.rooms[DEFAULT_ROOM].protocol
+
+    def get(self, room_id, create=True):
+        """Returns the room's protocol, creating the room if needed; None if that is not possible."""
+        room = self.rooms.get(room_id)
+        now = time.monotonic()
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            self.collect_garbage(now)
+        if room is None:
+            if not create or not ROOM_ID_PATTERN.match(room_id):
+                return None
+            with self._lock:
+                room = self.rooms.get(room_id)
+                if room is None:
+                    if len(self.rooms) >= MAX_ROOMS:
+                        return None
+                    protocol = PlayerServerProtocol()
+                    protocol.tick_rate = self.tick_rate
+                    room = self.rooms[room_id] = Room(room_id, protocol)
+                    logging.warning(f"ROOMS: Created room {room_id} ({len(self.rooms)} active).")
+        room.last_active = now
+        return room.protocol
+
+    def collect_garbage(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._last_sweep = now
+            expired = [room_id for room_id, room in self.rooms.items()
+                       if room_id != DEFAULT_ROOM and (
+                           now - room.last_active > ROOM_IDLE_TIMEOUT or
+                           (room.protocol.match_winner and now - room.last_active > FINISHED_ROOM_TIMEOUT))]
+            for room_id in expired:
+                self.rooms.pop(room_id).protocol.cancel_scheduled()
+        if expired:
+            logging.warning(f"ROOMS: Reclaimed {len(expired)} rooms ({len(self.rooms)} active).")
+        return len(expired)
+
+    def start_simulation(self, tick_rate):
+        """Server-authoritative mode for every room, driven by one shared tick thread."""
+        self.tick_rate = tick_rate
+        for room in list(self.rooms.values()):
+            room.protocol.tick_rate = tick_rate
+        threading.Thread(target=run_at_fixed_rate, args=(tick_rate, self._simulation_tick), daemon=True).start()
+        logging.warning(f"SERVER: Authoritative simulation running at {tick_rate} Hz.")
+
+    def _simulation_tick(self):
+        for room in list(self.rooms.values()):
+            room.protocol.simulation_tick()
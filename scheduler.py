@@ -0,0 +1,94 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# Cancelled events are dropped lazily; the heap is rebuilt once they are the majority.
+COMPACT_THRESHOLD = 64
+
+
+class ScheduledEvent:
+    __slots__ = ('when', 'callback', 'args', 'active')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        # False once the event has run or been cancelled.
+        self.active = True
+
+
+class Scheduler:
+    """Runs delayed callbacks for every match in the process from one thread.
+
+    Events sit in a heap ordered by deadline; the thread sleeps until the earliest one
+    is due (or a sooner one is added). Callbacks run on the scheduler thread, so they
+    must be short and take whatever locks they need themselves."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._pending, self._cancelled = 0, 0
+        self._thread = None
+
+    @property
+    def pending(self):
+        """Events scheduled and neither run nor cancelled yet."""
+        return self._pending
+
+    def call_later(self, delay, callback, *args):
+        event = ScheduledEvent(time.monotonic() + delay, callback, args)
+        with self._condition:
+            heapq.heappush(self._heap, (event.when, next(self._counter), event))
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return event
+
+    def cancel(self, event):
+        """Returns True if the event was still pending and now never runs."""
+        with self._condition:
+            if not event.active:
+                return False
+            event.active = False
+            self._pending -= 1
+            self._cancelled += 1
+            if self._cancelled > COMPACT_THRESHOLD and self._cancelled > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if entry[2].active]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+            return True
+
+    def _next_due(self):
+        # Called with the condition held; blocks until an active event is due and pops it.
+        while True:
+            while self._heap and not self._heap[0][2].active:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+            if not self._heap:
+                self._condition.wait()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay <= 0:
+                event = heapq.heappop(self._heap)[2]
+                event.active = False
+                self._pending -= 1
+                return event
+            self._condition.wait(delay)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                event = self._next_due()
+            try:
+                event.callback(*event.args)
+            except Exception:
+                logging.exception("SCHEDULER: Delayed event failed.")
+
+
+# One per server process, shared by every room.
+scheduler = Scheduler()
@@ -0,0 +1,135 @@
+"""Logging for the game server that stays off the request hot path.
+
+In async mode (the default) records go through a queue to one background thread that
+formats and writes them, so a request only pays for appending to the queue. Per-request
+and per-connection records are sampled per category (1 in N, see sampled), and error
+records are rate-limited per category so a misbehaving client cannot flood the log.
+
+    if server_log.sampled('request'):
+        server_log.event('request', "Request handled", client=address, bytes=size)
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_MODES = ('async', 'sync')
+# Beyond ERROR_BURST error records of one category per ERROR_INTERVAL seconds, further
+# ones are only counted; the next record written reports how many were suppressed.
+ERROR_BURST = 10
+ERROR_INTERVAL = 10.0
+
+_logger = logging.getLogger('game_server')
+_sample_rates = {}
+_counters = {}
+_error_windows = {}
+_error_lock = threading.Lock()
+_listener, _listener_pid = None, None
+
+
+class StructuredFormatter(logging.Formatter):
+    """The usual format, followed by the record's fields as key=value pairs."""
+
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += ' ' + ' '.join(f"{key}={json.dumps(value) if isinstance(value, str) else value}"
+                                      for key, value in fields.items())
+        return message
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    # The queue never leaves the process, so the record can be queued as it is and
+    # formatted by the writer thread instead of by the thread serving the request.
+    def prepare(self, record):
+        return record
+
+
+def setup(mode='async', sample_rates=None, level=logging.WARNING):
+    """Installs the server's log handlers on the root logger, replacing any others.
+
+    sample_rates maps a category to N (write 1 in N records, 0 for none); categories
+    not listed are written every time. Call again in each worker process."""
+    global _listener, _listener_pid
+    _sample_rates.clear()
+    _sample_rates.update(sample_rates or {})
+    _counters.clear()
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    # A listener inherited from the parent process has no thread here; just drop it.
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+    writer = logging.StreamHandler()
+    writer.setFormatter(StructuredFormatter(LOG_FORMAT))
+    if mode == 'async':
+        log_queue = queue.SimpleQueue()
+        root.addHandler(_InProcessQueueHandler(log_queue))
+        _listener, _listener_pid = logging.handlers.QueueListener(log_queue, writer), os.getpid()
+        _listener.start()
+    else:
+        root.addHandler(writer)
+    root.setLevel(level)
+
+
+def _flush():
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+
+atexit.register(_flush)
+
+
+def parse_sample_rate(text):
+    """'request=100' -> ('request', 100), for the --log-sample command line option."""
+    category, _, rate = text.partition('=')
+    if not category or not rate.isdigit():
+        raise ValueError(f"Expected CATEGORY=N, got {text!r}")
+    return category, int(rate)
+
+
+def sampled(category):
+    """True for 1 in every N calls for the category. Counting is not locked: a race
+    can only shift which record gets written, never the cost of the check."""
+    rate = _sample_rates.get(category, 1)
+    if rate <= 1:
+        return rate == 1
+    counter = _counters.get(category)
+    if counter is None:
+        counter = _counters.setdefault(category, itertools.count(1))
+    return next(counter) % rate == 0
+
+
+def event(category, message, level=logging.WARNING, **fields):
+    fields['category'] = category
+    rate = _sample_rates.get(category, 1)
+    if rate > 1:
+        fields['sampled'] = f"1/{rate}"
+    _logger.log(level, message, extra={'fields': fields})
+
+
+def error(category, message, **fields):
+    """An error record, unless this category already wrote ERROR_BURST of them recently."""
+    now = time.monotonic()
+    with _error_lock:
+        window_start, written, suppressed = _error_windows.get(category, (now, 0, 0))
+        if now - window_start >= ERROR_INTERVAL:
+            window_start, written = now, 0
+        if written >= ERROR_BURST:
+            _error_windows[category] = (window_start, written, suppressed + 1)
+            return
+        _error_windows[category] = (window_start, written + 1, 0)
+    if suppressed:
+        fields['suppressed'] = suppressed
+    fields['category'] = category
+    _logger.error(message, extra={'fields': fields})
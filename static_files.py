@@ -0,0 +1,126 @@
+"""Static file responses for HttpServer.
+
+Small files are kept, read once, in an LRU cache keyed by path and validated against the
+file's size and mtime. Larger ones are answered with a FileResponse: the server writes
+the header and then hands the open file to os.sendfile, so its bytes never pass through
+Python (where os.sendfile is missing, as on Windows, they are read and sent in chunks).
+"""
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+# Files up to this size are cached in memory; the cache as a whole stays under STATIC_CACHE_BYTES.
+MAX_CACHED_FILE_SIZE = 256 * 1024
+STATIC_CACHE_BYTES = 16 * 1024 * 1024
+# Largest piece handed to one non-blocking sendfile call.
+SENDFILE_CHUNK = 256 * 1024
+
+
+def etag(st):
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def last_modified(st):
+    return formatdate(st.st_mtime, usegmt=True)
+
+
+def not_modified(if_none_match, if_modified_since, st):
+    """True when the client's validators show its copy is current (If-None-Match wins)."""
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag(st) in tags or f"W/{etag(st)}" in tags
+    if if_modified_since is not None:
+        try:
+            return int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class FileBody:
+    """An open file still to be written to a socket, from offset on."""
+
+    def __init__(self, fp, length):
+        self.fp = fp
+        self.offset = 0
+        self.remaining = length
+
+    def send(self, connection):
+        """One non-blocking os.sendfile step; returns the number of bytes written."""
+        count = min(self.remaining, SENDFILE_CHUNK)
+        if hasattr(os, 'sendfile'):
+            sent = os.sendfile(connection.fileno(), self.fp.fileno(), self.offset, count)
+        else:
+            # No os.sendfile (Windows): read the piece and send it, like socket.sendfile does there.
+            self.fp.seek(self.offset)
+            data = self.fp.read(count)
+            sent = connection.send(data) if data else 0
+        if sent == 0:
+            # The file shrank underneath us; the connection cannot be kept in sync.
+            raise ConnectionError("File truncated while sending")
+        self.offset += sent
+        self.remaining -= sent
+        return sent
+
+    def send_all(self, connection):
+        """Blocking counterpart for connection threads (socket.sendfile uses os.sendfile)."""
+        sent = connection.sendfile(self.fp, self.offset, self.remaining)
+        self.offset += sent
+        self.remaining -= sent
+        return sent
+
+    def close(self):
+        self.fp.close()
+
+
+class FileResponse:
+    """Response whose body is sent from a file: head is the header bytes, body a FileBody."""
+
+    def __init__(self, head, body):
+        self.head = head
+        self.body = body
+
+    def __len__(self):
+        return len(self.head) + self.body.remaining
+
+
+class StaticFileCache:
+    def __init__(self, max_bytes=STATIC_CACHE_BYTES, max_file_size=MAX_CACHED_FILE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.entries = OrderedDict()
+        self.size = 0
+        # Connection threads share one cache.
+        self._lock = threading.Lock()
+
+    def get(self, path, st):
+        """The cached contents of path if they still match st, else None."""
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            size, mtime_ns, data = entry
+            if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+                self._drop(path)
+                return None
+            self.entries.move_to_end(path)
+            return data
+
+    def put(self, path, st, data):
+        if len(data) > self.max_file_size:
+            return
+        with self._lock:
+            self._drop(path)
+            self.entries[path] = (st.st_size, st.st_mtime_ns, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,258 @@
+"""Compact binary encoding for the game state responses of PlayerServerProtocol.
+
+A frame is a small header followed by tagged sections. Players, gems, walls,
+hazards and game_info are packed as fixed-layout struct records, strings are
+length-prefixed UTF-8. decode() returns exactly the dict json.loads would give
+for the same response, so callers do not care which format was negotiated.
+"""
+import json
+import struct
+
+CONTENT_TYPE = 'application/x-gob-state'
+JSON_CONTENT_TYPE = 'application/json'
+
+MAGIC, VERSION = b'GB', 2
+COLORS = ('black', 'white')
+
+_HEADER = struct.Struct('<2sB')
+_TAG = struct.Struct('<B')
+_U8 = struct.Struct('<B')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_F64 = struct.Struct('<d')
+_PLAYER = struct.Struct('<BiihHB')     # color, x, y, lives, gems_collected, flags
+_GEM = struct.Struct('<Bii')           # type, x, y
+_RECT = struct.Struct('<iiii')         # x, y, width, height
+_HAZARD = struct.Struct('<Biiii')      # type, x, y, width, height
+_GAME_INFO = struct.Struct('<BBHHdHH') # stage, total, score black/white, elapsed, required black/white
+
+_AT_EXIT, _IS_DEAD = 1, 2
+
+(TAG_LEVEL_VERSION, TAG_STATE_VERSION, TAG_CURRENT_STAGE, TAG_FULL, TAG_PLAYERS, TAG_GEMS,
+ TAG_REMOVED_GEMS, TAG_HAZARDS, TAG_WALLS, TAG_EXIT_AREA, TAG_IMAGES, TAG_GAME_INFO,
+ TAG_RESULTS, TAG_TICK, TAG_SERVER_TIME) = range(1, 16)
+
+# Batch sub-results are nested frames when they have a binary layout, JSON otherwise.
+_RESULT_JSON, _RESULT_BINARY = 0, 1
+
+_TAGS = {
+    'level_version': TAG_LEVEL_VERSION, 'state_version': TAG_STATE_VERSION,
+    'current_stage': TAG_CURRENT_STAGE, 'full': TAG_FULL, 'players': TAG_PLAYERS, 'gems': TAG_GEMS,
+    'removed_gems': TAG_REMOVED_GEMS, 'hazards': TAG_HAZARDS, 'walls': TAG_WALLS,
+    'exit_area': TAG_EXIT_AREA, 'images': TAG_IMAGES, 'game_info': TAG_GAME_INFO,
+    'results': TAG_RESULTS, 'tick': TAG_TICK, 'server_time': TAG_SERVER_TIME,
+}
+_KEYS = {tag: key for key, tag in _TAGS.items()}
+
+
+def accepts_binary(headers):
+    """True when one of the raw request header lines advertises CONTENT_TYPE."""
+    for header in headers:
+        name, _, value = header.partition(':')
+        if name.strip().lower() == 'accept' and CONTENT_TYPE in value:
+            return True
+    return False
+
+
+def can_encode(result):
+    """Only successful state-shaped responses have a binary layout; the rest stay JSON."""
+    return result.get('status') == 'OK' and all(key == 'status' or key in _TAGS for key in result)
+
+
+def encode_response(result, binary):
+    """Serializes a protocol result as (content type, body bytes): binary when the client
+    accepts it and the result has a layout, JSON otherwise."""
+    if binary and can_encode(result):
+        try:
+            return CONTENT_TYPE, encode(result)
+        except struct.error:
+            # A value outside its fixed-width field; JSON has no such limits.
+            pass
+    return JSON_CONTENT_TYPE, json.dumps(result).encode()
+
+
+def _pack_str(parts, value):
+    raw = value.encode('utf-8') if value else b''
+    parts.append(_U8.pack(len(raw)))
+    parts.append(raw)
+
+
+def _unpack_str(data, offset):
+    length = data[offset]
+    offset += 1
+    return (str(data[offset:offset + length], 'utf-8') if length else None), offset + length
+
+
+def encode(result):
+    parts = [_HEADER.pack(MAGIC, VERSION)]
+    for key, value in result.items():
+        if key == 'status':
+            continue
+        tag = _TAGS[key]
+        parts.append(_TAG.pack(tag))
+        if tag in (TAG_LEVEL_VERSION, TAG_STATE_VERSION, TAG_CURRENT_STAGE, TAG_TICK):
+            parts.append(_U32.pack(value))
+        elif tag == TAG_SERVER_TIME:
+            parts.append(_F64.pack(value))
+        elif tag == TAG_FULL:
+            parts.append(_U8.pack(1 if value else 0))
+        elif tag == TAG_PLAYERS:
+            parts.append(_U16.pack(len(value)))
+            for p_id, p in value.items():
+                _pack_str(parts, p_id)
+                flags = (_AT_EXIT if p.get('at_exit') else 0) | (_IS_DEAD if p.get('is_dead') else 0)
+                parts.append(_PLAYER.pack(COLORS.index(p['color_type']), p['x'], p['y'],
+                                          p['lives'], p['gems_collected'], flags))
+        elif tag == TAG_GEMS:
+            parts.append(_U16.pack(len(value)))
+            for g in value:
+                _pack_str(parts, g['id'])
+                parts.append(_GEM.pack(COLORS.index(g['type']), g['x'], g['y']))
+        elif tag == TAG_REMOVED_GEMS:
+            parts.append(_U16.pack(len(value)))
+            for g_id in value:
+                _pack_str(parts, g_id)
+        elif tag == TAG_HAZARDS:
+            parts.append(_U16.pack(len(value)))
+            for h in value:
+                _pack_str(parts, h['id'])
+                parts.append(_HAZARD.pack(COLORS.index(h['type']), h['x'], h['y'], h['width'], h['height']))
+        elif tag == TAG_WALLS:
+            parts.append(_U16.pack(len(value)))
+            for w in value:
+                _pack_str(parts, w['id'])
+                parts.append(_RECT.pack(w['x'], w['y'], w['width'], w['height']))
+        elif tag == TAG_EXIT_AREA:
+            parts.append(_RECT.pack(value['x'], value['y'], value['width'], value['height']))
+        elif tag == TAG_IMAGES:
+            parts.append(_U16.pack(len(value)))
+            for name, image_b64 in value.items():
+                raw = image_b64.encode('ascii')
+                _pack_str(parts, name)
+                parts.append(_U32.pack(len(raw)))
+                parts.append(raw)
+        elif tag == TAG_GAME_INFO:
+            scores, required = value['scores'], value['required_gems']
+            parts.append(_GAME_INFO.pack(value['current_stage'], value['total_stages'],
+                                         scores['player_black'], scores['player_white'],
+                                         value['elapsed_time'], required['black'], required['white']))
+            _pack_str(parts, value['stage_winner'])
+            _pack_str(parts, value['match_winner'])
+        elif tag == TAG_RESULTS:
+            parts.append(_U16.pack(len(value)))
+            for sub_result in value:
+                if can_encode(sub_result):
+                    kind, raw = _RESULT_BINARY, encode(sub_result)
+                else:
+                    kind, raw = _RESULT_JSON, json.dumps(sub_result).encode('utf-8')
+                parts.append(_U8.pack(kind))
+                parts.append(_U32.pack(len(raw)))
+                parts.append(raw)
+    return b''.join(parts)
+
+
+def decode(data):
+    data = memoryview(data)
+    magic, version = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a game state frame")
+    offset = _HEADER.size
+    result = {"status": "OK"}
+    end = len(data)
+    while offset < end:
+        tag = data[offset]
+        offset += 1
+        if tag in (TAG_LEVEL_VERSION, TAG_STATE_VERSION, TAG_CURRENT_STAGE, TAG_TICK):
+            value = _U32.unpack_from(data, offset)[0]
+            offset += _U32.size
+        elif tag == TAG_SERVER_TIME:
+            value = _F64.unpack_from(data, offset)[0]
+            offset += _F64.size
+        elif tag == TAG_FULL:
+            value = bool(data[offset])
+            offset += 1
+        elif tag == TAG_PLAYERS:
+            count = _U16.unpack_from(data, offset)[0]
+            offset += _U16.size
+            value = {}
+            for _ in range(count):
+                p_id, offset = _unpack_str(data, offset)
+                color, x, y, lives, gems_collected, flags = _PLAYER.unpack_from(data, offset)
+                offset += _PLAYER.size
+                value[p_id] = {'color_type': COLORS[color], 'x': x, 'y': y, 'lives': lives,
+                               'gems_collected': gems_collected, 'at_exit': bool(flags & _AT_EXIT),
+                               'is_dead': bool(flags & _IS_DEAD)}
+        elif tag == TAG_GEMS:
+            count = _U16.unpack_from(data, offset)[0]
+            offset += _U16.size
+            value = []
+            for _ in range(count):
+                g_id, offset = _unpack_str(data, offset)
+                gem_type, x, y = _GEM.unpack_from(data, offset)
+                offset += _GEM.size
+                value.append({'id': g_id, 'x': x, 'y': y, 'type': COLORS[gem_type]})
+        elif tag == TAG_REMOVED_GEMS:
+            count = _U16.unpack_from(data, offset)[0]
+            offset += _U16.size
+            value = []
+            for _ in range(count):
+                g_id, offset = _unpack_str(data, offset)
+                value.append(g_id)
+        elif tag == TAG_HAZARDS:
+            count = _U16.unpack_from(data, offset)[0]
+            offset += _U16.size
+            value = []
+            for _ in range(count):
+                h_id, offset = _unpack_str(data, offset)
+                hazard_type, x, y, width, height = _HAZARD.unpack_from(data, offset)
+                offset += _HAZARD.size
+                value.append({'id': h_id, 'type': COLORS[hazard_type], 'x': x, 'y': y, 'width': width, 'height': height})
+        elif tag == TAG_WALLS:
+            count = _U16.unpack_from(data, offset)[0]
+            offset += _U16.size
+            value = []
+            for _ in range(count):
+                w_id, offset = _unpack_str(data, offset)
+                x, y, width, height = _RECT.unpack_from(data, offset)
+                offset += _RECT.size
+                value.append({'id': w_id, 'x': x, 'y': y, 'width': width, 'height': height})
+        elif tag == TAG_EXIT_AREA:
+            x, y, width, height = _RECT.unpack_from(data, offset)
+            offset += _RECT.size
+            value = {'x': x, 'y': y, 'width': width, 'height': height}
+        elif tag == TAG_IMAGES:
+            count = _U16.unpack_from(data, offset)[0]
+            offset += _U16.size
+            value = {}
+            for _ in range(count):
+                name, offset = _unpack_str(data, offset)
+                length = _U32.unpack_from(data, offset)[0]
+                offset += _U32.size
+                value[name] = str(data[offset:offset + length], 'ascii')
+                offset += length
+        elif tag == TAG_GAME_INFO:
+            stage, total, score_black, score_white, elapsed, req_black, req_white = _GAME_INFO.unpack_from(data, offset)
+            offset += _GAME_INFO.size
+            stage_winner, offset = _unpack_str(data, offset)
+            match_winner, offset = _unpack_str(data, offset)
+            value = {
+                "current_stage": stage, "total_stages": total,
+                "scores": {'player_black': score_black, 'player_white': score_white},
+                "elapsed_time": elapsed, "stage_winner": stage_winner, "match_winner": match_winner,
+                "required_gems": {'black': req_black, 'white': req_white}
+            }
+        elif tag == TAG_RESULTS:
+            count = _U16.unpack_from(data, offset)[0]
+            offset += _U16.size
+            value = []
+            for _ in range(count):
+                kind = data[offset]
+                length = _U32.unpack_from(data, offset + 1)[0]
+                offset += 1 + _U32.size
+                raw = data[offset:offset + length]
+                value.append(decode(raw) if kind == _RESULT_BINARY else json.loads(str(raw, 'utf-8')))
+                offset += length
+        else:
+            raise ValueError(f"Unknown section tag {tag}")
+        result[_KEYS[tag]] = value
+    return result